@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2019 Benjamin Milde (Universitaet Hamburg)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# Persistent on-disk cache for sequitur g2p results
+#
+# Entries are keyed by (hash of the model file, normalized word, number of variants), so a retrained
+# model never returns stale pronunciations. The cache is a sqlite database in WAL mode, which allows
+# concurrent readers and writers from several processes (e.g. the joblib workers of select_candidates.py).
+# The least recently used entries are evicted once max_entries is exceeded, the number of entries is
+# checked on the first put and then every evict_interval put entries (counting them is a full scan).
+# The access time of an entry is only updated if it is older than atime_resolution seconds, so that
+# reads are usually read-only transactions that don't wait for the write lock.
+#
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+import sequiturclient
+
+_model_hashes = {}
+
+
+def model_hash(modelfn):
+    """sha1 of the model file, memoized as long as its size and mtime do not change."""
+    st = os.stat(modelfn)
+    key = (os.path.abspath(modelfn), st.st_size, st.st_mtime)
+
+    if key not in _model_hashes:
+        h = hashlib.sha1()
+        with open(modelfn, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        _model_hashes[key] = h.hexdigest()
+
+    return _model_hashes[key]
+
+
+def normalize_word(word, replaceDash=True):
+    word = word.strip()
+    if replaceDash:
+        word = word.replace("-","")
+    return word
+
+
+class G2PCache(object):
+
+    def __init__(self, filename='g2p_cache.sqlite', max_entries=2000000, timeout=60.0, evict_interval=10000,
+                 atime_resolution=86400.0):
+
+        self._filename = filename
+        self._max_entries = max_entries
+        self._timeout = timeout
+        self._evict_interval = evict_interval
+        self._atime_resolution = atime_resolution
+        # entries to put until the number of entries is checked again
+        self._puts_until_evict = 0
+
+        # one connection per process and thread, sqlite connections can't be shared
+        self._local = threading.local()
+
+        conn = self._conn()
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS g2p ('
+                         'model TEXT NOT NULL, word TEXT NOT NULL, variants INTEGER NOT NULL, '
+                         'phns TEXT NOT NULL, atime REAL NOT NULL, '
+                         'PRIMARY KEY (model, word, variants))')
+            conn.execute('CREATE INDEX IF NOT EXISTS g2p_atime ON g2p (atime)')
+
+    # the cache object is handed to joblib workers, they open their own connections
+    def __getstate__(self):
+        return {'_filename': self._filename, '_max_entries': self._max_entries, '_timeout': self._timeout,
+                '_evict_interval': self._evict_interval, '_atime_resolution': self._atime_resolution}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+        self._puts_until_evict = 0
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self._filename, timeout=self._timeout)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+
+        return conn
+
+    def get_many(self, modelfn, words, variants=5, replaceDash=True):
+        """Returns a dict word -> [{'proba', 'phn'}, ...] for all words that are in the cache."""
+        mh = model_hash(modelfn)
+        norm_map = {}
+        for word in words:
+            norm_map.setdefault(normalize_word(word, replaceDash), []).append(word)
+
+        conn = self._conn()
+        norms = list(norm_map)
+        phn_map = {}
+
+        # stay below sqlite's limit of host parameters per statement
+        for i in range(0, len(norms), 500):
+            chunk = norms[i:i + 500]
+            rows = conn.execute('SELECT word, phns, atime FROM g2p WHERE model=? AND variants=? AND word IN (%s)'
+                                % ','.join('?' * len(chunk)), [mh, variants] + chunk).fetchall()
+
+            now = time.time()
+            stale = [(now, mh, norm, variants) for norm, phns, atime in rows if atime < now - self._atime_resolution]
+            if stale:
+                with conn:
+                    conn.executemany('UPDATE g2p SET atime=? WHERE model=? AND word=? AND variants=?', stale)
+
+            for norm, phns, atime in rows:
+                xs = json.loads(phns)
+                for word in norm_map[norm]:
+                    phn_map[word] = xs
+
+        return phn_map
+
+    def put_many(self, modelfn, phn_map, variants=5, replaceDash=True):
+        mh = model_hash(modelfn)
+        now = time.time()
+
+        rows = [(mh, normalize_word(word, replaceDash), variants, json.dumps(xs), now)
+                for word, xs in phn_map.items() if xs]
+
+        conn = self._conn()
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO g2p (model, word, variants, phns, atime) VALUES (?, ?, ?, ?, ?)',
+                             rows)
+
+        self._puts_until_evict -= len(rows)
+        if self._puts_until_evict <= 0:
+            self._puts_until_evict = self._evict_interval
+            self._evict()
+
+    def _evict(self):
+        conn = self._conn()
+        num_entries = conn.execute('SELECT COUNT(*) FROM g2p').fetchone()[0]
+
+        if num_entries <= self._max_entries:
+            return
+
+        # evict a bit more than necessary, so that we don't have to evict on every put
+        num_evict = num_entries - int(self._max_entries * 0.9)
+
+        logging.debug('g2pcache: evicting %d of %d entries' % (num_evict, num_entries))
+
+        with conn:
+            conn.execute('DELETE FROM g2p WHERE rowid IN (SELECT rowid FROM g2p ORDER BY atime LIMIT ?)',
+                         (num_evict,))
+
+    def gen_phn_variants(self, modelfn, word, variants=5, replaceDash=True):
+        """Cached version of sequiturclient.get_engine(modelfn).gen_phn_variants."""
+        return self.gen_phn_variants_multi(modelfn, [word], variants, replaceDash).get(word, [])
+
+    def gen_phn_variants_multi(self, modelfn, words, variants=5, replaceDash=True):
+        """Cached version of sequiturclient.get_engine(modelfn).gen_phn_variants_multi,
+           only words that are not in the cache are decoded."""
+        phn_map = self.get_many(modelfn, words, variants, replaceDash)
+
+        # the engine decodes the same normalized word that is used as cache key
+        missing = {}
+        for word in words:
+            if word not in phn_map:
+                missing.setdefault(normalize_word(word, replaceDash), []).append(word)
+
+        if missing:
+            new_phns = sequiturclient.get_engine(modelfn).gen_phn_variants_multi(list(missing), variants=variants,
+                                                                                  replaceDash=False)
+            self.put_many(modelfn, new_phns, variants, replaceDash=False)
+            for norm, xs in new_phns.items():
+                for word in missing[norm]:
+                    phn_map[word] = xs
+
+        return phn_map
@@ -0,0 +1,392 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2019 Benjamin Milde (Universitaet Hamburg)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# Helpers for lexicon files in the "word phn phn phn" format
+# (dicts/lexicon_de_mary.txt, output_lexicon.txt of the editor)
+#
+
+import os
+import sys
+import hashlib
+import logging
+import threading
+
+
+def read_lexicon(filename):
+    """Yields (word, phn) tuples of a lexicon file."""
+    with open(filename, encoding='utf8') as in_file:
+        for line in in_file:
+
+            if line[-1] == '\n':
+                line = line[:-1]
+
+            if len(line) == 0:
+                continue
+
+            split = line.split(" ")
+            yield split[0], " ".join(split[1:])
+
+
+def index_key(word, replaceDash=True):
+    """Case folded word, with dashes removed like sequitur_gen_phn_variants(replaceDash=True) does."""
+    if replaceDash:
+        word = word.replace("-","")
+    return word.casefold()
+
+
+def _word_hash(word, replaceDash=True):
+    return int.from_bytes(hashlib.blake2b(index_key(word, replaceDash).encode('utf8'), digest_size=8).digest(), 'little')
+
+
+class KnownWordsIndex(object):
+    """Compact index of words that already have lexicon entries. Only 64 bit hashes of the
+       normalized words are kept, collisions are negligible for lexicons of a few million words."""
+
+    def __init__(self, lexicons=(), replaceDash=True):
+
+        self._replaceDash = replaceDash
+        self._hashes = set()
+
+        for filename in lexicons:
+            self.add_lexicon(filename)
+
+    def add_lexicon(self, filename):
+        if not os.path.isfile(filename):
+            logging.warning('lexicon: not indexing %s since there is none' % filename)
+            return
+
+        num_entries = len(self._hashes)
+
+        for word, phn in read_lexicon(filename):
+            self.add(word)
+
+        logging.info('lexicon: indexed %d new words from %s' % (len(self._hashes) - num_entries, filename))
+
+    def add_journaled_lexicon(self, filename):
+        """Indexes a lexicon that is edited through a LexiconJournal, with the edits in its journal."""
+        num_entries = len(self._hashes)
+
+        for word, phn in LexiconJournal(filename).load():
+            self.add(word)
+
+        logging.info('lexicon: indexed %d new words from %s and its journal' % (len(self._hashes) - num_entries, filename))
+
+    def add(self, word):
+        self._hashes.add(_word_hash(word, self._replaceDash))
+
+    def __contains__(self, word):
+        return _word_hash(word, self._replaceDash) in self._hashes
+
+    def __len__(self):
+        return len(self._hashes)
+
+
+def _read_journal(filename):
+    """Yields (seq, op, word, phn) of the complete records of a journal file."""
+    with open(filename, encoding='utf8') as journal:
+        for line in journal:
+
+            # a partially written last line of a crashed session
+            if line[-1:] != '\n':
+                break
+
+            split = line[:-1].split('\t')
+            if len(split) == 4:
+                try:
+                    seq = int(split[0])
+                except ValueError:
+                    continue
+                yield seq, split[1], split[2], split[3]
+            elif len(split) == 3:
+                # journals without sequence numbers
+                yield None, split[0], split[1], split[2]
+
+
+def _replay_journal(entries, filename, covered_seq):
+    """Applies the records of a journal after covered_seq to entries, as multiset operations
+       (the lexicon may contain the same entry more than once). Returns the last sequence number."""
+    last_seq = covered_seq
+
+    for seq, op, word, phn in _read_journal(filename):
+        if seq is not None:
+            last_seq = max(last_seq, seq)
+            # already part of the snapshot
+            if seq <= covered_seq:
+                continue
+
+        entry = (word, phn)
+        if op == '+':
+            entries.append(entry)
+        elif op == '-' and entry in entries:
+            entries.remove(entry)
+
+    return last_seq
+
+
+class LexiconJournal(object):
+    """Append-only journal of the add and delete operations on a lexicon file, so that saving an edit
+       costs one fsynced line instead of rewriting the whole lexicon. compact() periodically writes a
+       new snapshot of the lexicon (temp file + rename) in a background thread and starts a new journal,
+       load() replays the journal on top of the snapshot.
+
+       Journal records are numbered. Before a new snapshot replaces the lexicon, the number of the last
+       record it contains is written to lexicon_fn + '.journal.seq', together with the size and sha1 of
+       the snapshot, so that load() knows which records are already part of the lexicon file, even if a
+       compaction was interrupted."""
+
+    def __init__(self, lexicon_fn):
+
+        self._lexicon_fn = lexicon_fn
+        self._journal_fn = lexicon_fn + '.journal'
+        # the journal that is being folded into a new snapshot
+        self._compacting_fn = lexicon_fn + '.journal.compacting'
+        # "seq size sha1" of the latest snapshots
+        self._seq_fn = lexicon_fn + '.journal.seq'
+
+        self._lock = threading.Lock()
+        self._journal = None
+        self._num_ops = 0
+        self._seq = None
+        self._compactor = None
+
+    @property
+    def num_ops(self):
+        """Number of operations since the last compaction."""
+        return self._num_ops
+
+    def _read_seqs(self):
+        """Returns a list of (seq, size, sha1) of the latest snapshots, oldest first."""
+        if not os.path.isfile(self._seq_fn):
+            return []
+
+        seqs = []
+        with open(self._seq_fn, encoding='utf8') as seq_file:
+            for line in seq_file:
+                split = line.split()
+                if len(split) == 3:
+                    seqs.append((int(split[0]), int(split[1]), split[2]))
+        return seqs
+
+    def _load(self):
+        """Returns (entries, last sequence number)."""
+        data = b''
+        if os.path.isfile(self._lexicon_fn):
+            with open(self._lexicon_fn, 'rb') as in_file:
+                data = in_file.read()
+
+        entries = []
+        for line in data.decode('utf8').split('\n'):
+            if len(line) == 0:
+                continue
+            split = line.split(" ")
+            entries.append((split[0], " ".join(split[1:])))
+
+        # the records up to covered_seq are part of the snapshot, -1 if the lexicon file wasn't
+        # written by compact() (then there are no journals of an earlier snapshot either)
+        covered_seq = -1
+        size, sha1 = len(data), hashlib.sha1(data).hexdigest()
+        for seq, seq_size, seq_sha1 in self._read_seqs():
+            if seq_size == size and seq_sha1 == sha1:
+                covered_seq = seq
+
+        last_seq = covered_seq
+        for filename in (self._compacting_fn, self._journal_fn):
+            if os.path.isfile(filename):
+                last_seq = max(last_seq, _replay_journal(entries, filename, covered_seq))
+
+        return entries, last_seq
+
+    def load(self):
+        """Returns the lexicon as list of (word, phn) tuples."""
+        entries, last_seq = self._load()
+
+        with self._lock:
+            self._seq = max(self._seq or 0, last_seq)
+
+        return entries
+
+    def _open_journal(self):
+        journal = open(self._journal_fn, 'a', encoding='utf8')
+
+        # drop a partially written last line of a crashed session, so that it doesn't merge with the next one
+        with open(self._journal_fn, 'rb') as f:
+            data = f.read()
+        if len(data) > 0 and not data.endswith(b'\n'):
+            journal.truncate(data.rfind(b'\n') + 1)
+
+        return journal
+
+    def _append(self, op, word, phn):
+        with self._lock:
+            if self._seq is None:
+                self._seq = max(0, self._load()[1])
+
+            if self._journal is None:
+                self._journal = self._open_journal()
+
+            self._seq += 1
+            self._journal.write('%d\t%s\t%s\t%s\n' % (self._seq, op, word, phn))
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+
+            self._num_ops += 1
+
+    def add(self, word, phn):
+        self._append('+', word, phn)
+
+    def delete(self, word, phn):
+        self._append('-', word, phn)
+
+    def compact(self, entries, wait=False):
+        """Writes entries, the complete current lexicon (including all operations journaled so far),
+           as new snapshot. Returns False if a compaction is still running and wait is False."""
+
+        if self._compactor is not None and self._compactor.is_alive():
+            if not wait:
+                return False
+            self._compactor.join()
+
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+            if os.path.isfile(self._journal_fn):
+                if os.path.isfile(self._compacting_fn):
+                    # left over from an interrupted compaction, keep both for replay
+                    with open(self._compacting_fn, 'a', encoding='utf8') as compacting, \
+                            open(self._journal_fn, encoding='utf8') as journal:
+                        compacting.write(journal.read())
+                    os.remove(self._journal_fn)
+                else:
+                    os.rename(self._journal_fn, self._compacting_fn)
+
+            self._num_ops = 0
+            seq = self._seq or 0
+
+        self._compactor = threading.Thread(target=self._write_snapshot, args=(list(entries), seq))
+        self._compactor.start()
+
+        if wait:
+            self._compactor.join()
+
+        return True
+
+    def _write_snapshot(self, entries, seq):
+        data = ''.join(word + ' ' + phn + '\n' for word, phn in entries).encode('utf8')
+
+        tmp_fn = self._lexicon_fn + '.tmp'
+        with open(tmp_fn, 'wb') as out_file:
+            out_file.write(data)
+            out_file.flush()
+            os.fsync(out_file.fileno())
+
+        # record which journal records the snapshot contains before it replaces the lexicon. The
+        # previous record is kept, it still describes the lexicon file if we crash before the replace
+        seqs = self._read_seqs()[-1:] + [(seq, len(data), hashlib.sha1(data).hexdigest())]
+        seq_tmp_fn = self._seq_fn + '.tmp'
+        with open(seq_tmp_fn, 'w', encoding='utf8') as seq_file:
+            for record in seqs:
+                seq_file.write('%d %d %s\n' % record)
+            seq_file.flush()
+            os.fsync(seq_file.fileno())
+        os.replace(seq_tmp_fn, self._seq_fn)
+
+        os.replace(tmp_fn, self._lexicon_fn)
+
+        if os.path.isfile(self._compacting_fn):
+            os.remove(self._compacting_fn)
+
+        logging.info('lexicon: wrote snapshot of %d entries to %s' % (len(entries), self._lexicon_fn))
+
+
+class Lexicon(object):
+    """In-memory lexicon: the (word, phn) entries in their order, plus a map from each word to its
+       pronunciations for O(1) lookups. Listeners registered with add_listener are called as
+       listener(op, index, entries) after every change, op is 'insert' or 'delete'."""
+
+    def __init__(self, entries=()):
+
+        self._entries = []
+        self._phns = {}
+        self._listeners = []
+
+        self.extend(entries)
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def _notify(self, op, index, entries):
+        for listener in self._listeners:
+            listener(op, index, entries)
+
+    def append(self, word, phn):
+        self.extend([(word, phn)])
+
+    def extend(self, entries):
+        index = len(self._entries)
+
+        # the word string is shared between the entry tuple and the pronunciation map
+        new_entries = []
+        for word, phn in entries:
+            word = sys.intern(word)
+            new_entries.append((word, phn))
+            self._phns.setdefault(word, []).append(phn)
+
+        if new_entries:
+            self._entries += new_entries
+            self._notify('insert', index, new_entries)
+
+    def delete(self, index):
+        """Deletes the entry at index and returns it as (word, phn) tuple."""
+        word, phn = entry = self._entries.pop(index)
+
+        phns = self._phns[word]
+        phns.remove(phn)
+        if not phns:
+            del self._phns[word]
+
+        self._notify('delete', index, [entry])
+        return entry
+
+    def pronunciations(self, word):
+        """All pronunciations of word, in the order they were added."""
+        return tuple(self._phns.get(word, ()))
+
+    def has_entry(self, word, phn):
+        return phn in self._phns.get(word, ())
+
+    def words(self):
+        """Words of all entries, in order (i.e. with repetitions for multiple pronunciations)."""
+        return [word for word, phn in self._entries]
+
+    def __contains__(self, word):
+        return word in self._phns
+
+    def __getitem__(self, index):
+        return self._entries[index]
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
@@ -24,8 +24,11 @@
 # based on Code from Hugh Sasse (maryclient-http.py)
 #
 
+import io
 import sys
 import re
+import socket
+import threading
 import traceback
 import logging
 
@@ -45,33 +48,151 @@ except ImportError:
 
 import xml.etree.ElementTree as ET
 
+from collections import OrderedDict
+from xml.sax.saxutils import escape as xml_escape
+
 
 def _compress_ws(s):
-    vc = True
+    # collapses runs of spaces and drops trailing ones (a leading space is kept)
+    return re.sub(u' +', u' ', s).rstrip(u' ')
 
-    res = ''
 
-    for c in s:
+def _mary_gather_ph(parent):
+
+    res = ""
+
+    for child in parent:
+        r = _mary_gather_ph(child)
+        if len(r) > 0:
+            res += r + " "
+
+    if 'ph' in parent.attrib:
+        res += parent.attrib['ph'] + " "
+
+    return _compress_ws(res)
+
+
+def _clean_ph(mph):
+    return re.sub(u"^ \?", "", re.sub(u"^ ' \?", "'", mph))
+
+
+def _parse_g2p(xmls):
+    """MARY phonemes of a PHONEMES output document."""
+
+    root = ET.fromstring(xmls)
+
+    # print "ROOT: %s" % repr(root)
+
+    mph = _mary_gather_ph(root)
+
+    return _clean_ph(mph)
 
-        if c == ' ':
-            vc = False
-        else:
-            if vc:
-                res = res + c
-            else:
-                res = res + ' ' + c
-            vc = True
+
+def _parse_g2p_paragraphs(xmls):
+    """MARY phonemes of every <p> of a PHONEMES output document, in document order.
+       The document is parsed iteratively, ph attributes are collected in the same
+       (children first) order as _mary_gather_ph."""
+
+    res = []
+    phs = None
+
+    for event, elem in ET.iterparse(io.BytesIO(xmls), events=('start', 'end')):
+
+        tag = elem.tag.rsplit('}', 1)[-1]
+
+        if event == 'start':
+            if tag == 'p':
+                phs = []
+            continue
+
+        if phs is not None and 'ph' in elem.attrib:
+            phs.append(elem.attrib['ph'])
+
+        if tag == 'p':
+            res.append(_clean_ph(_compress_ws(' '.join(phs))))
+            phs = None
+
+        elem.clear()
 
     return res
 
 
+def _words_maryxml(locale, words):
+    # one paragraph per word, so that MARY's tokens can be mapped back to the input words
+    return '<maryxml xmlns="http://mary.dfki.de/2002/MaryXML" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" version="0.5" xml:lang="%s">%s</maryxml>' % (
+        locale[:2], ''.join('<p>%s</p>' % xml_escape(word.lower()) for word in words))
+
+
+def _phonemes_maryxml(locale, phonemes):
+    return '<maryxml xmlns="http://mary.dfki.de/2002/MaryXML" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" version="0.5" xml:lang="%s"><p><s><t ' \
+           'g2p_method="lexicon" ph="%s" pos="NE"></t></s></p></maryxml>' % (locale[:2], phonemes)
+
+
+def _parse_voices(res):
+    voices = []
+    for line in res.split('\n'):
+        voices.append(line.split(' '))
+    return voices
+
+
+class _ConnectionPool(object):
+    """Small pool of persistent (keep-alive) HTTP connections to one MARY server."""
+
+    def __init__(self, host, port, max_idle=4):
+        self._host = host
+        self._port = port
+        self._max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def get(self, connect_timeout, read_timeout):
+        """Returns (connection, reused)."""
+        with self._lock:
+            if self._idle:
+                conn = self._idle.pop()
+                conn.sock.settimeout(read_timeout)
+                return conn, True
+
+        conn = httplib.HTTPConnection(self._host, self._port, timeout=connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(read_timeout)
+        return conn, False
+
+    def put(self, conn):
+        with self._lock:
+            if conn.sock is not None and len(self._idle) < self._max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _get_pool(host, port, max_idle):
+    with _pools_lock:
+        if (host, port) not in _pools:
+            _pools[(host, port)] = _ConnectionPool(host, port, max_idle)
+        return _pools[(host, port)]
+
+
 class MaryTTS(object):
 
     def __init__(self,
                  host="127.0.0.1",
                  port=59125,
                  locale="en_US",
-                 voice="cmu-rms-hsmm"):
+                 voice="cmu-rms-hsmm",
+                 connect_timeout=5.0,
+                 read_timeout=60.0,
+                 pool_size=4):
 
         self.input_type = "TEXT"
         self.output_type = "AUDIO"
@@ -82,13 +203,56 @@ class MaryTTS(object):
         self._locale = locale
         self._voice = voice
 
-    def _generate(self, message):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_size = pool_size
+
+    def _request(self, method, url, params, headers):
+        """Sends a request over a pooled keep-alive connection and returns the response body.
+           A pooled connection the server has closed in the meantime is replaced transparently."""
+
+        pool = _get_pool(self._host, self._port, self.pool_size)
+
+        while True:
+            conn, reused = pool.get(self.connect_timeout, self.read_timeout)
+
+            try:
+                # conn.set_debuglevel(5)
+                conn.request(method, url, params, headers)
+                response = conn.getresponse()
+                body = response.read()
+            except (httplib.HTTPException, socket.error) as e:
+                conn.close()
+                if reused and not isinstance(e, socket.timeout):
+                    logging.debug('maryclient: pooled connection dropped (%s), reconnecting' % repr(e))
+                    continue
+                raise
+
+            if response.will_close:
+                conn.close()
+            else:
+                pool.put(conn)
+
+            if response.status != 200:
+                logging.error(response.getheaders())
+                raise Exception("{0}: {1}".format(response.status, response.reason))
+
+            return body
+
+    def close(self):
+        """Closes the idle pooled connections to this client's server."""
+        _get_pool(self._host, self._port, self.pool_size).close()
+
+    def _generate(self, message, input_type=None, output_type=None):
         """Given a message in message,
            return a response in the appropriate
-           format."""
+           format. input_type and output_type default to
+           self.input_type and self.output_type, passing them
+           explicitly keeps concurrent requests from different
+           threads independent of each other."""
         raw_params = {"INPUT_TEXT": message.encode('UTF8'),
-                      "INPUT_TYPE": self.input_type,
-                      "OUTPUT_TYPE": self.output_type,
+                      "INPUT_TYPE": input_type or self.input_type,
+                      "OUTPUT_TYPE": output_type or self.output_type,
                       "LOCALE": self._locale,
                       "AUDIO": self.audio,
                       "VOICE": self._voice,
@@ -98,48 +262,42 @@ class MaryTTS(object):
 
         logging.debug('maryclient: generate, raw_params=%s' % repr(raw_params))
 
-        # Open connection to self._host, self._port.
-        conn = httplib.HTTPConnection(self._host, self._port)
-
-        # conn.set_debuglevel(5)
-
-        conn.request("POST", "/process", params, headers)
-        response = conn.getresponse()
-        if response.status != 200:
-            logging.error(response.getheaders())
-            raise Exception("{0}: {1}".format(response.status, response.reason))
-        return response.read()
+        return self._request("POST", "/process", params, headers)
 
     def _mary_gather_ph(self, parent):
+        return _mary_gather_ph(parent)
 
-        res = ""
-
-        for child in parent:
-            r = self._mary_gather_ph(child)
-            if len(r) > 0:
-                res += r + " "
-
-        if 'ph' in parent.attrib:
-            res += parent.attrib['ph'] + " "
+    def g2p(self, word):
 
-        return _compress_ws(res)
+        xmls = self._generate(word.lower(), input_type="TEXT", output_type="PHONEMES")
 
-    def g2p(self, word):
+        # print "Got: For %s %s" % (graph.encode('utf-8'), xmls)
 
-        self.input_type = "TEXT"
-        self.output_type = "PHONEMES"
+        return _parse_g2p(xmls)
 
-        xmls = self._generate(word.lower())
+    def g2p_many(self, words, batch_size=500):
+        """MARY phonemes for a list of words, batch_size words per request.
+           Returns a dict word -> phonemes (same format as g2p)."""
 
-        # print "Got: For %s %s" % (graph.encode('utf-8'), xmls)
+        # unique words, in input order
+        words = list(OrderedDict.fromkeys(words))
+        phn_map = {}
 
-        root = ET.fromstring(xmls)
+        for i in range(0, len(words), batch_size):
+            batch = words[i:i + batch_size]
 
-        # print "ROOT: %s" % repr(root)
+            xmls = self._generate(_words_maryxml(self.locale, batch), input_type="RAWMARYXML", output_type="PHONEMES")
+            phns = _parse_g2p_paragraphs(xmls)
 
-        mph = self._mary_gather_ph(root)
+            if len(phns) != len(batch):
+                logging.warning('maryclient: g2p_many got %d results for %d words, falling back to g2p'
+                                % (len(phns), len(batch)))
+                for word in batch:
+                    phn_map[word] = self.g2p(word)
+            else:
+                phn_map.update(zip(batch, phns))
 
-        return re.sub(u"^ \?", "", re.sub(u"^ ' \?", "'", mph))
+        return phn_map
 
     def synth_wav(self, txt, fmt='txt'):
 
@@ -153,13 +311,9 @@ class MaryTTS(object):
         wav = None
 
         try:
-            s = '<maryxml xmlns="http://mary.dfki.de/2002/MaryXML" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" version="0.5" xml:lang="%s"><p><s><t ' \
-                'g2p_method="lexicon" ph="%s" pos="NE"></t></s></p></maryxml>' % (
-                    self.locale[:2], phonemes)
+            s = _phonemes_maryxml(self.locale, phonemes)
 
-            self.input_type = "PHONEMES"
-            self.output_type = "AUDIO"
-            wav = self._generate(s)
+            wav = self._generate(s, input_type="PHONEMES", output_type="AUDIO")
 
         except:
             logging.error("*** ERROR: unexpected error: %s " % sys.exc_info()[0])
@@ -176,21 +330,9 @@ class MaryTTS(object):
 
         logging.debug('maryclient: voices, raw_params=%s' % repr(raw_params))
 
-        # Open connection to self._host, self._port.
-        conn = httplib.HTTPConnection(self._host, self._port)
-
-        # conn.set_debuglevel(5)
-
-        conn.request("GET", "/voices", params, headers)
-        response = conn.getresponse()
-        if response.status != 200:
-            logging.error(response.getheaders())
-            raise Exception("{0}: {1}".format(response.status, response.reason))
-        res = response.read().decode('utf8')
+        res = self._request("GET", "/voices", params, headers).decode('utf8')
 
-        voices = []
-        for line in res.split('\n'):
-            voices.append(line.split(' '))
+        voices = _parse_voices(res)
 
         logging.debug('maryclient: voices=%s' % repr(voices))
 
@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2019 Benjamin Milde (Universitaet Hamburg)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# asyncio counterpart of marytts.MaryTTS for bulk operations (pre-rendering audio for a lexicon,
+# gathering MARY's g2p for a word list), e.g.
+#
+#   async def main():
+#       mary = AsyncMaryTTS(locale='de_DE', voice='dfki-pavoque-neutral', max_concurrency=16)
+#       async for word, phn in mary.map(mary.g2p, words):
+#           print(word, phn)
+#       await mary.close()
+#
+#   asyncio.run(main())
+#
+# Only the standard library is used: requests go over a pool of keep-alive HTTP/1.1 connections,
+# at most max_concurrency at a time, failed requests are retried with exponential backoff.
+#
+
+import asyncio
+import logging
+
+from urllib.parse import urlencode
+
+from collections import OrderedDict
+
+from marytts import _parse_g2p, _parse_g2p_paragraphs, _phonemes_maryxml, _parse_voices, _words_maryxml
+
+
+class MaryHTTPError(Exception):
+
+    def __init__(self, status, reason):
+        super(MaryHTTPError, self).__init__("{0}: {1}".format(status, reason))
+        self.status = status
+        self.reason = reason
+
+
+class _StaleConnection(Exception):
+    pass
+
+
+class AsyncMaryTTS(object):
+
+    def __init__(self,
+                 host="127.0.0.1",
+                 port=59125,
+                 locale="en_US",
+                 voice="cmu-rms-hsmm",
+                 max_concurrency=8,
+                 max_retries=3,
+                 backoff=0.5,
+                 connect_timeout=5.0,
+                 read_timeout=60.0):
+
+        self.audio = "WAVE_FILE"
+
+        self._host = host
+        self._port = port
+        self._locale = locale
+        self._voice = voice
+
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+        # created on first use, so that they belong to the running event loop
+        self._semaphore = None
+        self._idle = []
+
+    async def _connect(self):
+        """Returns (reader, writer, reused)."""
+        if self._idle:
+            return self._idle.pop() + (True,)
+
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(self._host, self._port), self.connect_timeout)
+        return reader, writer, False
+
+    async def _read_body(self, reader, headers):
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    return b''.join(chunks)
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+
+        if 'content-length' in headers:
+            return await reader.readexactly(int(headers['content-length']))
+
+        return await reader.read()
+
+    async def _request_once(self, method, url, params):
+        reader, writer, reused = await self._connect()
+
+        try:
+            body = params.encode('ascii')
+            head = ("%s %s HTTP/1.1\r\n"
+                    "Host: %s:%d\r\n"
+                    "Content-Type: application/x-www-form-urlencoded\r\n"
+                    "Content-Length: %d\r\n"
+                    "Connection: keep-alive\r\n\r\n" % (method, url, self._host, self._port, len(body)))
+            writer.write(head.encode('ascii') + body)
+            await writer.drain()
+
+            async def read_response():
+                status_line = await reader.readline()
+                if not status_line:
+                    if reused:
+                        raise _StaleConnection()
+                    raise ConnectionResetError('connection closed by MARY server')
+
+                version, status, reason = status_line.decode('latin1').rstrip('\r\n').split(' ', 2)
+
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode('latin1').rstrip('\r\n')
+                    if not line:
+                        break
+                    key, value = line.split(':', 1)
+                    headers[key.strip().lower()] = value.strip()
+
+                return int(status), reason, headers, await self._read_body(reader, headers)
+
+            status, reason, headers, data = await asyncio.wait_for(read_response(), self.read_timeout)
+
+        except BaseException:
+            writer.close()
+            raise
+
+        if headers.get('connection', '').lower() == 'close' or 'content-length' not in headers \
+                and headers.get('transfer-encoding', '').lower() != 'chunked':
+            writer.close()
+        else:
+            self._idle.append((reader, writer))
+
+        if status != 200:
+            raise MaryHTTPError(status, reason)
+
+        return data
+
+    async def _request(self, method, url, params):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async with self._semaphore:
+            attempt = 0
+            while True:
+                try:
+                    return await self._request_once(method, url, params)
+                except _StaleConnection:
+                    # the server closed an idle keep-alive connection, not a failed attempt
+                    continue
+                except (OSError, EOFError, ValueError, asyncio.TimeoutError, MaryHTTPError) as e:
+                    # client errors (4xx) won't get better by retrying
+                    if isinstance(e, MaryHTTPError) and e.status < 500 or attempt == self.max_retries:
+                        raise
+                    delay = self.backoff * (2 ** attempt)
+                    logging.debug('maryclient: %s %s failed (%s), retrying in %.1fs' % (method, url, repr(e), delay))
+                    await asyncio.sleep(delay)
+                    attempt += 1
+
+    async def _generate(self, message, input_type, output_type):
+        raw_params = {"INPUT_TEXT": message.encode('UTF8'),
+                      "INPUT_TYPE": input_type,
+                      "OUTPUT_TYPE": output_type,
+                      "LOCALE": self._locale,
+                      "AUDIO": self.audio,
+                      "VOICE": self._voice,
+                      }
+
+        logging.debug('maryclient: generate, raw_params=%s' % repr(raw_params))
+
+        return await self._request("POST", "/process", urlencode(raw_params))
+
+    async def g2p(self, word):
+        xmls = await self._generate(word.lower(), "TEXT", "PHONEMES")
+        return _parse_g2p(xmls)
+
+    async def g2p_many(self, words, batch_size=500):
+        """Same as marytts.MaryTTS.g2p_many, the batches are requested concurrently."""
+
+        async def g2p_batch(batch):
+            xmls = await self._generate(_words_maryxml(self._locale, batch), "RAWMARYXML", "PHONEMES")
+            phns = _parse_g2p_paragraphs(xmls)
+
+            if len(phns) != len(batch):
+                logging.warning('maryclient: g2p_many got %d results for %d words, falling back to g2p'
+                                % (len(phns), len(batch)))
+                phns = [await self.g2p(word) for word in batch]
+
+            return zip(batch, phns)
+
+        words = list(OrderedDict.fromkeys(words))
+        batches = [words[i:i + batch_size] for i in range(0, len(words), batch_size)]
+        phn_map = {}
+
+        async for batch, res in self.map(g2p_batch, batches):
+            if isinstance(res, Exception):
+                raise res
+            phn_map.update(res)
+
+        return phn_map
+
+    async def synth_wav(self, txt, fmt='txt'):
+
+        if fmt == 'txt':
+            phonemes = await self.g2p(txt)
+        elif fmt == 'xs':
+            phonemes = txt
+        else:
+            raise Exception('unknown format: %s' % fmt)
+
+        return await self._generate(_phonemes_maryxml(self._locale, phonemes), "PHONEMES", "AUDIO")
+
+    async def voices(self):
+        res = (await self._request("GET", "/voices", "")).decode('utf8')
+        return _parse_voices(res)
+
+    async def map(self, fn, items, *args, **kwargs):
+        """Applies the coroutine function fn (e.g. self.g2p or self.synth_wav) to all items and yields
+           (item, result) in input order. Only a bounded window of requests is scheduled at any time,
+           so arbitrarily long (lazy) item iterables can be used. Failed items yield their exception
+           as result."""
+
+        window = []
+
+        async def run(item):
+            try:
+                return await fn(item, *args, **kwargs)
+            except Exception as e:
+                logging.error('maryclient: %s failed for %s: %s' % (fn.__name__, repr(item), repr(e)))
+                return e
+
+        for item in items:
+            window.append((item, asyncio.ensure_future(run(item))))
+            if len(window) >= 2 * self.max_concurrency:
+                item, task = window.pop(0)
+                yield item, await task
+
+        for item, task in window:
+            yield item, await task
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for reader, writer in idle:
+            writer.close()
+
+    @property
+    def host(self):
+        return self._host
+
+    @property
+    def port(self):
+        return self._port
+
+    @property
+    def locale(self):
+        return self._locale
+
+    @locale.setter
+    def locale(self, v):
+        self._locale = v
+
+    @property
+    def voice(self):
+        return self._voice
+
+    @voice.setter
+    def voice(self, v):
+        self._voice = v
@@ -18,6 +18,8 @@
 # limitations under the License.
 #
 
+from collections import OrderedDict
+
 #
 # big phoneme table
 #
@@ -206,69 +208,80 @@ XSAMPA_normalization = {
 }
 
 
-def _normalize(s, norm_table):
-    buf = ""
+# normalization tables compiled into str.translate maps: {table id: translate map}
+_compiled_normalizations = {}
 
-    for c in s:
 
-        if c in norm_table:
+def _normalize(s, norm_table):
+    key = id(norm_table)
 
-            x = norm_table[c]
-            if x:
-                buf += x
-        else:
-            buf += c
+    if key not in _compiled_normalizations:
+        _compiled_normalizations[key] = {ord(c): (x if x else None) for c, x in norm_table.items()}
 
-    return buf
+    return s.translate(_compiled_normalizations[key])
 
 
-def _translate(graph, s, f_idx, t_idx, spaces=False):
-    buf = ""
-    i = 0
-    l = len(s)
+# compiled lookup tables: {(table id, from idx, to idx): (dict from symbol -> to symbol, max symbol length)}
+_compiled_tables = {}
 
-    while i < l:
 
-        found = False
+def _compile_table(table, f_idx, t_idx):
+    key = (id(table), f_idx, t_idx)
 
-        for pl in range(MAX_PHONEME_LENGTH, 0, -1):
+    if key not in _compiled_tables:
+        mapping = {}
 
-            if i + pl > l:
+        for pe in table:
+            if len(pe) <= max(f_idx, t_idx):
                 continue
+            # first entry wins, like the linear scan over the table did
+            if pe[f_idx] not in mapping:
+                mapping[pe[f_idx]] = pe[t_idx]
 
-            substr = s[i: i + pl]
+        _compiled_tables[key] = (mapping, max(len(p_f) for p_f in mapping))
 
-            # print u"i: %s, pl: %d, substr: '%s'" % (i, pl, substr)
+    return _compiled_tables[key]
 
-            for pe in big_phoneme_table:
-                p_f = pe[f_idx]
-                p_t = pe[t_idx]
 
-                if substr == p_f:
-                    buf += p_t
-                    i += pl
-                    if i < l and s[i] != u'ː' and spaces:
-                        buf += ' '
-                    found = True
-                    break
+def phoneme_inventory(idx):
+    """Set of all symbols of one column of the big phoneme table (0: IPA, 1: XSAMPA, 2: MARY, 3: ESPEAK)."""
+    return set(_compile_table(big_phoneme_table, idx, idx)[0])
 
-            if found:
+
+def _translate(graph, s, f_idx, t_idx, spaces=False):
+    mapping, max_len = _compile_table(big_phoneme_table, f_idx, t_idx)
+
+    buf = []
+    i = 0
+    l = len(s)
+
+    while i < l:
+
+        for pl in range(min(max_len, l - i), 0, -1):
+
+            p_t = mapping.get(s[i: i + pl])
+
+            if p_t is not None:
+                buf.append(p_t)
+                i += pl
+                if i < l and s[i] != u'ː' and spaces:
+                    buf.append(' ')
                 break
 
-        if not found:
+        else:
             p = s[i]
 
             msg = (u"_translate: %s: %s Phoneme not found: %s (%s)" % (graph, s, p, repr(p))).encode('UTF8')
 
             raise Exception(msg)
 
-    return buf
+    return "".join(buf)
 
 
 def ipa_move_stress_to_vowels(ipa):
     stress = False
 
-    res = u''
+    res = []
 
     for c in ipa:
 
@@ -277,12 +290,12 @@ def ipa_move_stress_to_vowels(ipa):
             continue
 
         if stress and c in IPA_vowels:
-            res += '\''
+            res.append('\'')
             stress = False
 
-        res += c
+        res.append(c)
 
-    return res
+    return u''.join(res)
 
 
 def ipa2xsampa(graph, ipas, spaces=False, stress_to_vowels=True):
@@ -333,9 +346,14 @@ ESPEAK_normalization = {
 }
 
 
+# the rules are applied one after the other, in table order, as a rule can create a match of a later one
+# (e.g. deleting a marker between 'p' and 'F')
+_ESPEAK_normalization_rules = tuple(ESPEAK_normalization.items())
+
+
 def espeak2ipa(graph, ms):
-    for c in ESPEAK_normalization:
-        ms = ms.replace(c, ESPEAK_normalization[c])
+    for c, x in _ESPEAK_normalization_rules:
+        ms = ms.replace(c, x)
     return _translate(graph, ms, 3, 0)
 
 
@@ -486,43 +504,58 @@ XARPABET_normalization = {
 def xsampa2xarpabet(graph, s):
     s = _normalize(s, XARPABET_normalization)
 
-    buf = ""
+    mapping, max_len = _compile_table(xs2xa_table, 0, 1)
+
+    buf = []
     i = 0
     l = len(s)
 
     while i < l:
 
-        found = False
+        for pl in range(min(max_len, l - i), 0, -1):
 
-        for pl in range(MAX_PHONEME_LENGTH, 0, -1):
+            p_t = mapping.get(s[i: i + pl])
 
-            if i + pl > l:
-                continue
+            if p_t is not None:
+                buf.append(p_t)
+                i += pl
+                break
 
-            substr = s[i: i + pl]
+        else:
+            p = s[i]
 
-            # print u"i: %s, pl: %d, substr: '%s'" % (i, pl, substr)
+            msg = u"xsampa2xarpabet: graph:'%s' - s:'%s' Phoneme not found: '%s' (%d) '%s'" % (graph, s, p, ord(p), s[i:])
 
-            for pe in xs2xa_table:
-                p_f = pe[0]
-                p_t = pe[1]
+            raise Exception(msg.encode('UTF8'))
 
-                if substr == p_f:
-                    if len(buf) > 0:
-                        buf += ' '
-                    buf += p_t
-                    i += pl
-                    found = True
-                    break
+    return " ".join(buf)
 
-            if found:
-                break
 
-        if not found:
-            p = s[i]
+def convert_many(converter, entries, memo_size=65536, **kwargs):
+    """Converts an iterable of (graph, pronunciation) pairs with one of the converters above,
+       e.g. convert_many(mary2ipa, read_lexicon(fn)) or convert_many(ipa2xsampa, entries, spaces=True).
 
-            msg = u"xsampa2xarpabet: graph:'%s' - s:'%s' Phoneme not found: '%s' (%d) '%s'" % (graph, s, p, ord(p), s[i:])
+       Yields (graph, result, error) tuples in input order: error is None on success, on failure
+       result is None and error is the exception, so one bad entry does not stop a whole lexicon.
+       Results of repeated pronunciations are served from a bounded LRU memo."""
 
-            raise Exception(msg.encode('UTF8'))
+    memo = OrderedDict()
+
+    for graph, pron in entries:
+
+        if pron in memo:
+            memo.move_to_end(pron)
+            yield graph, memo[pron], None
+            continue
+
+        try:
+            result = converter(graph, pron, **kwargs)
+        except Exception as e:
+            yield graph, None, e
+            continue
+
+        memo[pron] = result
+        if len(memo) > memo_size:
+            memo.popitem(last=False)
 
-    return buf
+        yield graph, result, None
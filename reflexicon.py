@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2019 Benjamin Milde (Universitaet Hamburg)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# Read-only reference lexicons (e.g. dicts/lexicon_de_mary.txt) with exact, prefix and suffix lookups,
+# and NeighbourIndex, the words of a reference lexicon with the most similar spelling
+#
+# An index file, built on first use and whenever one of the lexicons changed, holds the normalized
+# words (lexicon.index_key) of all entries in sorted order, with the position of each entry in its
+# lexicon file. Index and lexicons are memory mapped, a lookup is a binary search over the index
+# and only reads the matching lines, so that lexicons of millions of entries can be used without
+# loading them.
+#
+# Index file layout (little endian):
+#
+#   magic (8 bytes), number of entries n, number of lexicons, length of the lexicon table (int64)
+#   lexicon table (json: path, size and mtime of the lexicons), padded to 8 bytes
+#   n + 1 int64 start offsets of the keys in the key block
+#   n int64 entry references, lexicon number << 48 | offset of the line in the lexicon
+#   n int64 entry numbers, sorted by the reversed keys (for suffix lookups)
+#   key block, the keys in utf8, each followed by a newline
+#
+
+import os
+import json
+import mmap
+import struct
+import logging
+
+from array import array
+from collections import Counter
+from operator import add
+from itertools import accumulate, chain, repeat
+
+from lexicon import index_key
+
+MAGIC = b'SLEXIDX2'
+_header = struct.Struct('<8sqqq')
+_offset_bits = 48
+
+
+def _lexicon_table(lexicons):
+    table = []
+    for filename in lexicons:
+        st = os.stat(filename)
+        table.append({'path': os.path.abspath(filename), 'size': st.st_size, 'mtime': st.st_mtime})
+    return table
+
+
+def build_index(lexicons, index_fn):
+    """Writes the index of the lexicon files to index_fn."""
+    keys = []
+    refs = array('q')
+
+    for lexicon_no, filename in enumerate(lexicons):
+        with open(filename, 'rb') as in_file:
+            offset = 0
+            for line in in_file:
+                word = line.split(b' ', 1)[0].rstrip(b'\r\n')
+                if word:
+                    keys.append(index_key(word.decode('utf8')).encode('utf8'))
+                    refs.append(lexicon_no << _offset_bits | offset)
+                offset += len(line)
+
+    # sorted by utf8 bytes, the same order as by code points. Stable, so entries of the same key
+    # stay in the order of the lexicons
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+
+    key_block = b'\n'.join(keys[i] for i in order) + b'\n' if keys else b''
+    key_offsets = array('q', chain((0,), accumulate(map(add, (len(keys[i]) for i in order), repeat(1)))))
+    refs = array('q', (refs[i] for i in order))
+    # reversing the utf8 bytes keeps the suffixes of characters together
+    suffix_order = array('q', sorted(range(len(order)), key=lambda j: keys[order[j]][::-1]))
+
+    table = json.dumps(_lexicon_table(lexicons)).encode('utf8')
+    table += b' ' * (-len(table) % 8)
+
+    tmp_fn = index_fn + '.tmp'
+    with open(tmp_fn, 'wb') as out_file:
+        out_file.write(_header.pack(MAGIC, len(keys), len(lexicons), len(table)))
+        out_file.write(table)
+        out_file.write(key_offsets.tobytes())
+        out_file.write(refs.tobytes())
+        out_file.write(suffix_order.tobytes())
+        out_file.write(key_block)
+    os.replace(tmp_fn, index_fn)
+
+    logging.info('reflexicon: indexed %d entries of %s in %s' % (len(keys), ', '.join(lexicons), index_fn))
+
+
+class ReferenceLexicon(object):
+    """Exact and prefix lookups in one or more lexicon files, all words are normalized with
+       lexicon.index_key. The index file is (re)built if it is missing or out of date."""
+
+    def __init__(self, lexicons, index_fn):
+
+        self._lexicons = []
+        for filename in lexicons:
+            if os.path.isfile(filename):
+                self._lexicons.append(filename)
+            else:
+                logging.warning('reflexicon: not using %s since there is none' % filename)
+
+        self._index_fn = index_fn
+
+        if not self._open():
+            build_index(self._lexicons, index_fn)
+            if not self._open():
+                raise Exception('could not open reference lexicon index %s' % index_fn)
+
+        self._files = []
+        for filename in self._lexicons:
+            with open(filename, 'rb') as f:
+                # mmap doesn't support empty files
+                self._files.append(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                                   if os.fstat(f.fileno()).st_size > 0 else b'')
+
+    def _open(self):
+        """Maps the index, returns False if there is none or if it doesn't match the lexicons."""
+        if not os.path.isfile(self._index_fn):
+            return False
+
+        with open(self._index_fn, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            magic, n, num_lexicons, table_len = _header.unpack_from(mm, 0)
+            table = json.loads(mm[_header.size:_header.size + table_len].decode('utf8'))
+        except:
+            magic, table = None, None
+
+        if magic != MAGIC or table != _lexicon_table(self._lexicons):
+            mm.close()
+            return False
+
+        start = _header.size + table_len
+        view = memoryview(mm)
+
+        self._mm = mm
+        self._view = view
+        self._len = n
+        self._key_offsets = view[start:start + 8 * (n + 1)].cast('q')
+        self._refs = view[start + 8 * (n + 1):start + 8 * (2 * n + 1)].cast('q')
+        self._suffix_order = view[start + 8 * (2 * n + 1):start + 8 * (3 * n + 1)].cast('q')
+        self._key_start = start + 8 * (3 * n + 1)
+
+        return True
+
+    def __len__(self):
+        return self._len
+
+    def key(self, i):
+        """Normalized word of entry i (in sorted order) as utf8 bytes."""
+        return self._mm[self._key_start + self._key_offsets[i]:self._key_start + self._key_offsets[i + 1] - 1]
+
+    def entry(self, i):
+        """(word, phn) of entry i (in sorted order), as it is in the lexicon file."""
+        ref = self._refs[i]
+        data = self._files[ref >> _offset_bits]
+        offset = ref & ((1 << _offset_bits) - 1)
+
+        end = data.find(b'\n', offset)
+        line = data[offset:end if end != -1 else len(data)].decode('utf8').rstrip('\r')
+
+        word, sep, phn = line.partition(' ')
+        return word, phn
+
+    def _reversed_key(self, j):
+        return self.key(self._suffix_order[j])[::-1]
+
+    def _lower_bound(self, key, get_key=None):
+        get_key = get_key or self.key
+        lo, hi = 0, self._len
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if get_key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def lookup(self, word):
+        """All (word, phn) entries of word."""
+        key = index_key(word).encode('utf8')
+
+        entries = []
+        i = self._lower_bound(key)
+        while i < self._len and self.key(i) == key:
+            entries.append(self.entry(i))
+            i += 1
+
+        return entries
+
+    def __contains__(self, word):
+        key = index_key(word).encode('utf8')
+        i = self._lower_bound(key)
+        return i < self._len and self.key(i) == key
+
+    def prefix(self, prefix, limit=None):
+        """(word, phn) entries of the words starting with prefix, in sorted order, at most limit."""
+        key = index_key(prefix).encode('utf8')
+
+        entries = []
+        i = self._lower_bound(key)
+        while i < self._len and self.key(i).startswith(key) and (limit is None or len(entries) < limit):
+            entries.append(self.entry(i))
+            i += 1
+
+        return entries
+
+    def suffix(self, suffix, limit=None):
+        """(word, phn) entries of the words ending with suffix, at most limit."""
+        key = index_key(suffix).encode('utf8')[::-1]
+
+        entries = []
+        i = self._lower_bound(key, self._reversed_key)
+        while i < self._len and self._reversed_key(i).startswith(key) and (limit is None or len(entries) < limit):
+            entries.append(self.entry(self._suffix_order[i]))
+            i += 1
+
+        return entries
+
+    def _siblings(self, key, parts, find, limit):
+        # the entries of the word itself are among the matches
+        num_own = len(self.lookup(key))
+
+        for part in parts:
+            entries = [entry for entry in find(part, limit + num_own) if index_key(entry[0]) != key]
+            if entries:
+                return entries[:limit]
+
+        return []
+
+    def siblings(self, word, limit=10, min_prefix=3):
+        """Entries of other words that share the longest possible prefix (at least min_prefix
+           characters) with word."""
+        key = index_key(word)
+        return self._siblings(key, [key[:length] for length in range(len(key), min_prefix - 1, -1)],
+                              self.prefix, limit)
+
+    def suffix_siblings(self, word, limit=10, min_suffix=3):
+        """Entries of other words that share the longest possible suffix (at least min_suffix
+           characters) with word, e.g. the last part of a compound."""
+        key = index_key(word)
+        return self._siblings(key, [key[len(key) - length:] for length in range(len(key), min_suffix - 1, -1)],
+                              self.suffix, limit)
+
+    def close(self):
+        for data in self._files:
+            if data:
+                data.close()
+        self._key_offsets.release()
+        self._refs.release()
+        self._suffix_order.release()
+        self._view.release()
+        self._mm.close()
+
+
+def edit_distance(a, b, max_distance=None):
+    """Levenshtein distance of a and b, or max_distance + 1 if it is larger than max_distance."""
+    if max_distance is not None and abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+
+    row = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        prev, row[0] = row[0], i
+        for j, cb in enumerate(b, 1):
+            prev, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, prev + (ca != cb))
+        if max_distance is not None and min(row) > max_distance:
+            return max_distance + 1
+
+    return row[-1]
+
+
+class NeighbourIndex(object):
+    """Words of a ReferenceLexicon with the most similar spelling. Candidates are the words sharing the
+       most character n-grams (with word boundaries) with the query, they are ranked by edit distance."""
+
+    def __init__(self, reference_lexicon, n=3, max_candidates=200):
+
+        self._lexicon = reference_lexicon
+        self._n = n
+        self._max_candidates = max_candidates
+
+        # the distinct normalized words and the number of their first entry in reference_lexicon
+        self._words = []
+        self._first = array('q')
+        self._postings = {}
+
+        prev_key = None
+        for i in range(len(reference_lexicon)):
+            key = reference_lexicon.key(i)
+            if key == prev_key:
+                continue
+            prev_key = key
+
+            word_id = len(self._words)
+            word = key.decode('utf8')
+            self._words.append(word)
+            self._first.append(i)
+
+            for gram in self._grams(word):
+                postings = self._postings.get(gram)
+                if postings is None:
+                    postings = self._postings[gram] = array('i')
+                postings.append(word_id)
+
+        # n-grams that occur in a large part of the words are not useful to find candidates
+        self._max_postings = max(1000, len(self._words) // 20)
+
+        logging.info('reflexicon: indexed %d %d-grams of %d words' % (len(self._postings), n, len(self._words)))
+
+    def _grams(self, word):
+        padded = '\x02' + word + '\x03'
+        return set(padded[i:i + self._n] for i in range(max(1, len(padded) - self._n + 1)))
+
+    def neighbours(self, word, k=5, max_distance=None):
+        """Up to k (word, phn, distance) tuples of other words with the smallest edit distance to word,
+           with the pronunciation of their first entry."""
+        key = index_key(word)
+
+        counts = Counter()
+        for gram in self._grams(key):
+            postings = self._postings.get(gram)
+            if postings is not None and len(postings) <= self._max_postings:
+                counts.update(postings)
+
+        best = []
+        for word_id, shared in counts.most_common(self._max_candidates):
+            candidate = self._words[word_id]
+            if candidate == key:
+                continue
+
+            # only candidates that could still be among the k best have to be computed exactly
+            bound = best[-1][0] if len(best) == k else max_distance
+            distance = edit_distance(key, candidate, bound)
+            if bound is not None and distance > bound:
+                continue
+
+            best.append((distance, -shared, candidate, word_id))
+            best.sort()
+            del best[k:]
+
+        return [self._lexicon.entry(self._first[word_id]) + (distance,) for distance, shared, candidate, word_id in best]
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2019 Benjamin Milde (Universitaet Hamburg)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# Incremental search index for the word lists of the editor (todo list, words and pronunciations
+# of the lexicon)
+#
+# The entries are stored in segments, each a single "\nentry\nentry\n...\n" string (lower cased for
+# case insensitive search) plus the start offsets of the entries. Substring, exact and regex queries
+# are then one str.find / str.rfind / re search per segment, so that there is no python loop over
+# the entries and nothing has to be built per entry. Appended entries go to the last segment,
+# deleted entries are only marked and skipped.
+#
+
+import re
+
+from array import array
+from bisect import bisect_left, bisect_right
+from operator import add
+from itertools import accumulate, chain, islice, repeat
+
+# entries are appended to the last segment until it has this many characters
+segment_size = 4 * 1024 * 1024
+
+
+class _Segment(object):
+
+    def __init__(self):
+        self.text = '\n'
+        # offsets[i] is the start of entry i in text, offsets[-1] is len(text)
+        self.offsets = array('q', [1])
+        self.ids = array('q')
+
+    def extend(self, block, ids):
+        start = len(self.text)
+        self.text += block + '\n'
+        self.offsets.extend(islice(accumulate(chain((start,), map(add, map(len, block.split('\n')), repeat(1)))),
+                                   1, None))
+        self.ids.extend(ids)
+
+    def entry(self, pos):
+        """Index of the entry at text position pos."""
+        return bisect_right(self.offsets, pos) - 1
+
+
+class SearchIndex(object):
+    """Search index over a list of single line strings, that is kept in sync with the list through
+       extend() and delete(). find() returns list indices."""
+
+    def __init__(self, texts=(), casefold=True):
+
+        self._casefold = casefold
+        self._segments = []
+        # stable ids of the entries in list order, deleted ids are removed
+        self._ids = array('q')
+        self._deleted = set()
+        self._next_id = 0
+
+        self.extend(texts)
+
+    def _key(self, text):
+        return text.lower() if self._casefold else text
+
+    def extend(self, texts):
+        texts = list(texts)
+        if not texts:
+            return
+
+        ids = range(self._next_id, self._next_id + len(texts))
+        self._next_id += len(texts)
+
+        if not self._segments or len(self._segments[-1].text) > segment_size:
+            self._segments.append(_Segment())
+
+        self._segments[-1].extend(self._key('\n'.join(texts)), ids)
+        self._ids.extend(ids)
+
+    def append(self, text):
+        self.extend([text])
+
+    def delete(self, index):
+        self._deleted.add(self._ids.pop(index))
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _compile(self, query, mode):
+        """Returns (search function, offset of the entry start relative to the match, 1 if the newlines
+           around the searched entries are part of the search range, else 0)."""
+        if mode == 'regex':
+            pattern = re.compile(query, re.MULTILINE | (re.IGNORECASE if self._casefold else 0))
+            def search(text, start, end, backward):
+                if backward:
+                    last = None
+                    for m in pattern.finditer(text, start, end):
+                        last = m
+                    return last.start() if last else -1
+                m = pattern.search(text, start, end)
+                return m.start() if m else -1
+            # a regex could match the newlines around the entries
+            return search, 0, 0
+
+        query = self._key(query)
+        if '\n' in query:
+            return (lambda text, start, end, backward: -1), 0, 1
+
+        if mode == 'exact':
+            query = '\n' + query + '\n'
+        elif mode != 'substring':
+            raise ValueError('unknown search mode: %s' % mode)
+
+        def search(text, start, end, backward):
+            return text.rfind(query, start, end) if backward else text.find(query, start, end)
+        return search, 1 if mode == 'exact' else 0, 1
+
+    def find(self, query, start=0, backward=False, mode='substring'):
+        """Index of the first entry at or after start (at or before start with backward=True) that
+           contains query (mode='substring'), is query (mode='exact') or matches the regular expression
+           query (mode='regex', ^ and $ match at the entry boundaries). Returns -1 if there is none."""
+
+        if start < 0 or start >= len(self._ids):
+            return -1
+
+        # everything contains the empty string
+        if mode == 'substring' and not query:
+            return start
+
+        search, lead, margin = self._compile(query, mode)
+        start_id = self._ids[start]
+
+        segments = reversed(self._segments) if backward else self._segments
+        for seg in segments:
+            if not seg.ids or (seg.ids[0] > start_id if backward else seg.ids[-1] < start_id):
+                continue
+
+            if backward:
+                lo, hi = 0, bisect_right(seg.ids, start_id)
+            else:
+                lo, hi = bisect_left(seg.ids, start_id), len(seg.ids)
+            lo_pos, hi_pos = seg.offsets[lo] - margin, seg.offsets[hi] - 1 + margin
+
+            while lo_pos <= hi_pos:
+                pos = search(seg.text, lo_pos, hi_pos, backward)
+                if pos == -1:
+                    break
+
+                entry = seg.entry(pos + lead)
+                entry_id = seg.ids[entry]
+                if entry_id not in self._deleted:
+                    return bisect_left(self._ids, entry_id)
+
+                # skip the deleted entry
+                if backward:
+                    hi_pos = seg.offsets[entry] - 1 + margin
+                else:
+                    lo_pos = seg.offsets[entry + 1] - margin
+
+        return -1
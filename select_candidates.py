@@ -18,8 +18,14 @@
 #
 #
 
-import sequiturclient
+import g2pcache
+import lexicon
+import os
 import math
+import time
+import heapq
+import tempfile
+import itertools
 
 import multiprocessing
 from joblib import Parallel, delayed
@@ -27,48 +33,307 @@ from joblib import Parallel, delayed
 input_vocabulary = "voc.txt"
 output_file = "voc_todo.txt"
 sequitur_model = "dicts/de_g2p_model-6"
+g2p_cache_file = "g2p_cache.sqlite"
 num_variants = 3
 cutoff = 1000000
 num_read = 0
 candidate_dict = []
 num_cores = multiprocessing.cpu_count()
 
+# score the vocabulary in a few large shards per core (one long-lived g2p engine per shard),
+# instead of one joblib task per word
+batch_mode = True
+shards_per_core = 4
+
+# streaming mode reads voc.txt lazily and scores it in shards, with only a few shards per core in
+# flight, so that memory stays flat. With top_k > 0 only the best top_k candidates are kept in a
+# heap, with top_k = 0 the full ranking is produced by spilling sorted runs of spill_size candidates
+# to disk and merging them.
+streaming_mode = True
+shard_size = 10000
+top_k = 0
+spill_size = 500000
+
+# streaming runs append every scored shard to a journal (fsynced), a restarted run skips the shards
+# that are already in the journal (by their position in voc.txt, which must not change in between)
+# and ranks the journal at the end
+journal_file = output_file + ".journal"
+resume = True
+num_resumed = 0
+
+# words that already have an entry in one of these lexicons are dropped before g2p scoring
+known_lexicons = ["dicts/lexicon_de_mary.txt"]
+# the lexicon of the editor is read together with its journal, which holds the edits that aren't
+# compacted into the lexicon file yet
+editor_lexicon = "output_lexicon.txt"
+num_known = 0
+
+g2p_cache = g2pcache.G2PCache(g2p_cache_file)
+
 inputs = []
 
+def score_word(word, occs, phns):
+    try:
+        proba = float(phns[0]["proba"])
+    except:
+        print("Warning, automatic translation failed for: ", word)
+        return (word, occs * -10.0, math.nan, occs)
+
+    return (word, (1.0 - proba) * math.log10(float(occs)), proba, occs)
+
 def process_word(elem):
     word, occs, num_read = elem
 
     try:
-        phns = sequiturclient.sequitur_gen_phn_variants(sequitur_model, word, variants=num_variants, quiet=True)
-        proba = phns[0]["proba"]
+        phns = g2p_cache.gen_phn_variants(sequitur_model, word, variants=num_variants)
     except:
-        print("Warning, automatic translation failed for: ", word)
-        return (word, occs * -10.0, math.nan, occs)
+        phns = []
 
-    if num_read % 100 == 0:
+    if num_read % 100 == 0 and len(phns) > 0:
         print("[%d/%d]" % (num_read,cutoff),"At word:", word, phns[0]["proba"], phns[0]["phn"])
 
-    return (word, (1.0 - float(phns[0]["proba"])) * math.log10(float(occs)), float(phns[0]["proba"]), occs)
+    return score_word(word, occs, phns)
+
+def process_shard(shard):
+    words = [word for word, occs, num_read in shard]
+
+    try:
+        phn_map = g2p_cache.gen_phn_variants_multi(sequitur_model, words, variants=num_variants)
+    except:
+        print("Warning, automatic translation failed for shard starting at: ", words[0])
+        phn_map = {}
+
+    print("[%d/%d]" % (shard[-1][2], cutoff), "Finished shard of", len(shard), "words")
+
+    return [score_word(word, occs, phn_map.get(word, [])) for word, occs, num_read in shard]
+
+def split_shards(inputs, num_shards):
+    shard_size = max(1, int(math.ceil(len(inputs) / float(num_shards))))
+    return [inputs[i:i + shard_size] for i in range(0, len(inputs), shard_size)]
+
+def format_candidate(elem):
+    return elem[0] + " " + str(elem[1]) + " " + str(elem[2]) + " " + str(elem[3]) + "\n"
+
+# candidates are ranked by score, ties by word, so that all modes write the same ranking
+# regardless of the order in which the shards were scored
+def candidate_order(elem):
+    return (-elem[1], elem[0])
+
+def candidate_line_order(line):
+    word, score = line.split(" ", 2)[:2]
+    return (-float(score), word)
+
+def read_vocabulary(filename):
+    global num_read
+
+    with open(filename) as voc:
+        for line in voc:
+            if num_read > cutoff:
+                break
+
+            word, occs = line.split()
+            yield (word, int(occs), num_read)
+
+            num_read += 1
+
+def skip_known(elems, known_words):
+    global num_known
+
+    for elem in elems:
+        if elem[0] in known_words:
+            num_known += 1
+        else:
+            yield elem
+
+def iter_shards(elems, size):
+    elems = iter(elems)
+    while True:
+        shard = list(itertools.islice(elems, size))
+        if not shard:
+            return
+        yield shard
+
+def parse_candidate(line):
+    word, score, proba, occs = line.split(" ")
+    return (word, float(score), float(proba), int(occs))
+
+def parse_scored_range(line):
+    first, end = line.split(" ")
+    return (int(first), int(end))
+
+def load_journal(filename):
+    # returns the vocabulary ranges of the shards that are completely in the journal, and the offset
+    # after the last of them. Lines of a shard that was written only partially by a killed run are dropped
+    scored_ranges = []
+    offset = 0
+
+    if os.path.isfile(filename):
+        with open(filename, "rb") as journal:
+            pos = 0
+            for line in journal:
+                if not line.endswith(b"\n"):
+                    break
+                pos += len(line)
+                try:
+                    line = line[:-1].decode("utf8")
+                    if line.count(" ") == 1:
+                        scored_ranges.append(parse_scored_range(line))
+                        offset = pos
+                    else:
+                        parse_candidate(line)
+                except:
+                    break
+
+    return scored_ranges, offset
+
+def read_journal(filename):
+    with open(filename, encoding="utf8") as journal:
+        for line in journal:
+            if line.count(" ") != 1:
+                yield parse_candidate(line[:-1])
+
+def skip_scored(elems, scored_ranges):
+    # drops the elements in one of the scored ranges, by their vocabulary position. The vocabulary
+    # is read in order, so the ranges are walked through once
+    global num_resumed
+
+    ranges = iter(sorted(scored_ranges))
+    scored_range = next(ranges, None)
+
+    for elem in elems:
+        while scored_range is not None and scored_range[1] <= elem[2]:
+            scored_range = next(ranges, None)
+
+        if scored_range is not None and scored_range[0] <= elem[2]:
+            num_resumed += 1
+        else:
+            yield elem
+
+def process_journal_shard(shard):
+    # the vocabulary range of the shard, first position to last position + 1
+    return shard[0][2], shard[-1][2] + 1, process_shard(shard)
+
+def score_to_journal(elems, journal):
+    # at most max_in_flight shards are dispatched (and held in memory) at a time, enough to keep
+    # every worker busy. Each shard is journaled as soon as it is scored, in completion order,
+    # its candidates followed by a "first end" line with its vocabulary range, so that a restarted
+    # run can skip the scored shards by position
+    max_in_flight = num_cores * shards_per_core
+    num_scored = 0
+
+    with Parallel(n_jobs=num_cores, return_as="generator_unordered", pre_dispatch=max_in_flight) as parallel:
+        for first, end, shard_result in parallel(delayed(process_journal_shard)(shard)
+                                                 for shard in iter_shards(elems, shard_size)):
+            for elem in shard_result:
+                journal.write(format_candidate(elem))
+            journal.write("%d %d\n" % (first, end))
+            num_scored += len(shard_result)
+
+            journal.flush()
+            os.fsync(journal.fileno())
+
+    return num_scored
+
+def select_top_k(candidates, k):
+    # keeps a heap of k candidates
+    return heapq.nsmallest(k, candidates, key=candidate_order)
+
+def write_spill_run(run):
+    run.sort(key=candidate_order)
+    run_file = tempfile.TemporaryFile(mode="w+")
+    for elem in run:
+        run_file.write(format_candidate(elem))
+    run_file.seek(0)
+    return run_file
+
+def rank_external(candidates, voc_todo):
+    run_files = []
+    run = []
+
+    for elem in candidates:
+        run.append(elem)
+        if len(run) >= spill_size:
+            run_files.append(write_spill_run(run))
+            run = []
+
+    if run:
+        run_files.append(write_spill_run(run))
+
+    print("Merging", len(run_files), "sorted runs...")
+
+    num_written = 0
+    for line in heapq.merge(*run_files, key=candidate_line_order):
+        voc_todo.write(line)
+        num_written += 1
+
+    for run_file in run_files:
+        run_file.close()
+
+    return num_written
+
+known_words = lexicon.KnownWordsIndex(known_lexicons)
+known_words.add_journaled_lexicon(editor_lexicon)
+print("Loaded", len(known_words), "known words from", ", ".join(known_lexicons + [editor_lexicon]))
+
+print("Loading dictionary and computing g2p candidate dictionary with confidences!")
+start_time = time.time()
+
+if streaming_mode:
+
+    if resume:
+        scored_ranges, journal_offset = load_journal(journal_file)
+        if len(scored_ranges) > 0:
+            print("Resuming from", journal_file, "skipping", len(scored_ranges), "already scored shards")
+    else:
+        scored_ranges, journal_offset = [], 0
+
+    with open(journal_file, "a" if resume else "w", encoding="utf8") as journal:
+        journal.truncate(journal_offset)
+        num_scored = score_to_journal(skip_known(skip_scored(read_vocabulary(input_vocabulary), scored_ranges),
+                                                 known_words), journal)
+
+    elapsed = time.time() - start_time
+    print("Skipped %d words that are already in a lexicon" % num_known)
+    if num_resumed > 0:
+        print("Skipped %d words that were scored by an earlier run" % num_resumed)
+    print("Scored %d words in %.1f seconds (%.1f words/sec)" % (num_scored, elapsed, num_scored / max(elapsed, 1e-6)))
+
+    with open(output_file, "w") as voc_todo:
+        candidates = read_journal(journal_file)
+
+        if top_k > 0:
+            top_candidates = select_top_k(candidates, top_k)
+            for elem in top_candidates:
+                voc_todo.write(format_candidate(elem))
+            num_written = len(top_candidates)
+        else:
+            num_written = rank_external(candidates, voc_todo)
+
+    # the ranking is complete, the next run starts from scratch
+    os.remove(journal_file)
 
-with open(input_vocabulary) as voc:
-    for line in voc:
-        if num_read > cutoff:
-            break
+    print("Wrote %d candidates to %s" % (num_written, output_file))
 
-        word, occs = line.split()
-        occs = int(occs)
+else:
 
-        inputs += [(word, occs, num_read)]
+    inputs = list(skip_known(read_vocabulary(input_vocabulary), known_words))
+    print("Skipped %d words that are already in a lexicon" % num_known)
 
-        num_read += 1
+    if batch_mode:
+        shards = split_shards(inputs, num_cores * shards_per_core)
+        candidate_dict = [elem for shard_result in Parallel(n_jobs=num_cores)(delayed(process_shard)(shard) for shard in shards)
+                          for elem in shard_result]
+    else:
+        candidate_dict = Parallel(n_jobs=num_cores)(delayed(process_word)(elem) for elem in inputs)
 
-print("Loaded dictionary, now computing g2p candidate dictionary with confidences!")
-candidate_dict = Parallel(n_jobs=num_cores)(delayed(process_word)(elem) for elem in inputs)
+    elapsed = time.time() - start_time
+    print("Scored %d words in %.1f seconds (%.1f words/sec)" % (len(candidate_dict), elapsed,
+                                                                len(candidate_dict) / max(elapsed, 1e-6)))
 
-with open("voc_todo.txt", "w") as voc_todo:
+    with open(output_file, "w") as voc_todo:
 
-    print("Sorting dict...")
-    candidate_dict_sorted = sorted(candidate_dict, key=lambda kv: kv[1], reverse=True)
+        print("Sorting dict...")
+        candidate_dict_sorted = sorted(candidate_dict, key=candidate_order)
 
-    for elem in candidate_dict_sorted:
-        voc_todo.write(elem[0] + " " + str(elem[1]) + " " + str(elem[2]) + " " + str(elem[3]) + "\n")
+        for elem in candidate_dict_sorted:
+            voc_todo.write(format_candidate(elem))
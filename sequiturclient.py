@@ -21,8 +21,11 @@
 # crude sequitur g2p interface
 #
 
+import math
+import pickle
 import logging
 import tempfile
+import threading
 import traceback
 import subprocess
 # import misc
@@ -68,16 +71,15 @@ def sequitur_gen_phn_variants(modelfn, word, variants=5, quiet=False, replaceDas
             if 'stack usage:' in line:
                 continue
 
-            if word in line:
-                parts = line.split('\t')
+            parts = line.split('\t')
 
-                if len(parts) < 4:
-                    continue
+            if len(parts) < 4 or parts[0] != word:
+                continue
 
-                phn = {'proba': parts[2], 'phn': parts[3]}
-                # print 'XS', xs
-                xs.append(phn)
-                # ipa = xsampa2ipa(word, xs)
+            phn = {'proba': parts[2], 'phn': parts[3]}
+            # print 'XS', xs
+            xs.append(phn)
+            # ipa = xsampa2ipa(word, xs)
 
     return xs
 
@@ -165,3 +167,141 @@ def sequitur_gen_phn_multi(modelfn, words):
                 logging.error(traceback.format_exc())
 
     return phn_map
+
+
+def _normalized_words(words, replaceDash=True):
+    # maps the word as fed to g2p to all input words that normalize to it
+    norm_map = {}
+
+    for word in words:
+        norm = word.replace("-","") if replaceDash else word
+        norm_map.setdefault(norm, []).append(word)
+
+    return norm_map
+
+
+def sequitur_gen_phn_variants_multi(modelfn, words, variants=5, replaceDash=True):
+    """n-best variants for a whole word list in one g2p.py run.
+       Returns a dict word -> [{'proba', 'phn'}, ...], ranked best first."""
+    norm_map = _normalized_words(words, replaceDash)
+    ranked = {}
+
+    with tempfile.NamedTemporaryFile() as f:
+
+        for norm in norm_map:
+            f.write((u'%s\n' % norm).encode('utf8'))
+        f.flush()
+
+        cmd = ['g2p.py', '--encoding=UTF8', "--variants-number=" + str(variants), '--model', modelfn, '--apply', f.name]
+
+        res = run_command(cmd, capture_stderr=False)
+
+        logging.debug('%s' % ' '.join(cmd))
+
+        for l in res:
+
+            line = l.strip()
+
+            line = line.decode('utf8', errors='ignore')
+
+            logging.debug('%s' % line)
+
+            if 'stack usage:' in line:
+                continue
+
+            parts = line.split('\t')
+
+            if len(parts) < 4 or parts[0] not in norm_map:
+                continue
+
+            try:
+                ranked.setdefault(parts[0], []).append((int(parts[1]), {'proba': parts[2], 'phn': parts[3]}))
+            except:
+                logging.error("Error processing line %s:" % line)
+                logging.error(traceback.format_exc())
+
+    phn_map = {}
+
+    for norm, words_for_norm in norm_map.items():
+        xs = [phn for rank, phn in sorted(ranked.get(norm, []), key=lambda kv: kv[0])]
+        for word in words_for_norm:
+            phn_map[word] = xs
+
+    return phn_map
+
+
+class SequiturG2P(object):
+    """Resident sequitur g2p engine: loads the model once and keeps it in memory,
+       so that variant queries only pay for the decoding itself (no g2p.py process
+       start-up, no model reload)."""
+
+    def __init__(self, modelfn):
+
+        # sequitur is imported lazily, so that the subprocess based functions above
+        # keep working when only the g2p.py script is on the path
+        from sequitur import Translator
+
+        self._modelfn = modelfn
+
+        logging.debug('sequiturclient: loading model %s' % modelfn)
+
+        with open(modelfn, 'rb') as f:
+            model = pickle.load(f, encoding='latin1')
+
+        self._translator = Translator(model)
+
+        # the sequitur translator is not thread safe
+        self._lock = threading.Lock()
+
+    @property
+    def modelfn(self):
+        return self._modelfn
+
+    def gen_phn_variants(self, word, variants=5, replaceDash=True):
+        """Returns the same [{'proba', 'phn'}, ...] records as sequitur_gen_phn_variants."""
+        xs = []
+
+        if replaceDash:
+            word = word.replace("-","")
+
+        with self._lock:
+            try:
+                nbest = self._translator.nBestInit(tuple(word))
+
+                for i in range(variants):
+                    try:
+                        logLik, result = self._translator.nBestNext(nbest)
+                    except StopIteration:
+                        break
+
+                    posterior = math.exp(logLik - nbest.logLikTotal)
+                    xs.append({'proba': '%f' % posterior, 'phn': ' '.join(result)})
+            except Exception:
+                logging.error("Error translating word %s:" % word)
+                logging.error(traceback.format_exc())
+
+        return xs
+
+    def gen_phn_variants_multi(self, words, variants=5, replaceDash=True):
+        """Same as sequitur_gen_phn_variants_multi, but decoded in-process."""
+        norm_map = _normalized_words(words, replaceDash)
+        phn_map = {}
+
+        for norm, words_for_norm in norm_map.items():
+            xs = self.gen_phn_variants(norm, variants=variants, replaceDash=False)
+            for word in words_for_norm:
+                phn_map[word] = xs
+
+        return phn_map
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(modelfn):
+    """Returns the resident engine for modelfn, loading the model on first use."""
+    with _engines_lock:
+        if modelfn not in _engines:
+            _engines[modelfn] = SequiturG2P(modelfn)
+        return _engines[modelfn]
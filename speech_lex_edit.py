@@ -28,21 +28,114 @@
 from tkinter import *
 from functools import partial
 from datetime import datetime
-from tkinter import simpledialog
 from tkinter import messagebox as mbox
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import tts
-import sequiturclient
+import queue
+import threading
+import g2pcache
+import wavcache
+import lexicon
+import virtuallist
+import searchindex
+import reflexicon
 import sys
 import os
+import re
 import platform
 
 sequitur_model = "dicts/de_g2p_model-6"
 todo_wordlist = "todo_wordlist.txt"
 output_lexicon = "output_lexicon.txt"
+g2p_cache_file = "g2p_cache.sqlite"
+wav_cache_dir = "wav_cache"
 auto_save = True
 
-tts_client = tts.TTS()
+# with journaled_save, auto save appends each add/delete to output_lexicon.txt.journal instead of
+# rewriting output_lexicon.txt, a new snapshot is written in the background every compact_interval ms
+journaled_save = True
+compact_interval = 60000
+lexicon_journal = lexicon.LexiconJournal(output_lexicon)
+
+# the edited lexicon, the dictionary list box is kept in sync with it by a listener (see listbox_listener)
+lexicon_model = lexicon.Lexicon()
+
+# search indices of the todo list and of the words and pronunciations of the lexicon (phonemes are case sensitive)
+todo_index = searchindex.SearchIndex()
+lexicon_word_index = searchindex.SearchIndex()
+lexicon_phn_index = searchindex.SearchIndex(casefold=False)
+search_modes = ["word", "regex", "pronunciation"]
+search_background = None
+last_search_query = ""
+
+# synthesize all displayed g2p variants in the background as soon as they are shown,
+# so that pressing play only has to start the playback
+presynthesize = True
+num_synth_workers = 4
+# play() doesn't block the Tk thread, the synthesis runs in the background and is polled every
+# synth_poll_interval ms. Only the latest play request is played
+synth_poll_interval = 20
+latest_play_request = 0
+
+tts_client = tts.TTS(wav_cache=wavcache.WavCache(wav_cache_dir))
+synth_executor = ThreadPoolExecutor(max_workers=num_synth_workers)
+# synthesis for play(), so that it doesn't wait behind the pre-synthesis of other variants
+play_executor = ThreadPoolExecutor(max_workers=1)
+# phn -> future of its WAV data, for the currently displayed variants
+pending_synth = {}
+# the Tk window, set by start_window
+main_window = None
+g2p_cache = g2pcache.G2PCache(g2p_cache_file)
+
+# g2p (and the similar spelling search of show_reference) runs in the background, results are handed
+# to the Tk thread through g2p_results, which is polled every g2p_poll_interval ms
+g2p_executor = ThreadPoolExecutor(max_workers=2)
+g2p_results = queue.Queue()
+g2p_poll_interval = 20
+# id and future of the latest g2p request, results of older requests are stale and dropped
+latest_g2p_request = 0
+latest_g2p_future = None
+
+# look-ahead: when a word is selected, the variants of the next prefetch_next unannotated words of the
+# todo list and of the prefetch_around words around the selection are computed in the background
+prefetch_next = 10
+prefetch_around = 3
+prefetch_cache_size = 1000
+prefetch_executor = ThreadPoolExecutor(max_workers=1)
+prefetch_lock = threading.Lock()
+# (word, num_variants) -> phn_input_list, least recently used first
+prefetch_cache = OrderedDict()
+prefetch_pending = set()
+# the latest prefetch batch and its keys, a batch that hasn't started when the next one is submitted is cancelled
+prefetch_future = None
+prefetch_keys = []
+
+# reference lexicons: the pronunciations of the current word, of the num_neighbours words with the most
+# similar spelling and of the words sharing the longest prefix / suffix with it are shown below the g2p
+# variants. The index is a cache next to g2p_cache_file, it is rebuilt when one of the lexicons changed
+reference_lexicons = ["dicts/lexicon_de_mary.txt"]
+reference_index_file = "reference_lexicon.idx"
+num_reference_siblings = 5
+num_neighbours = 5
+# both opened (and the index built if needed) in the background by load_reference_lexicon,
+# the neighbour index is queried on g2p_executor
+reference_lexicon = None
+neighbour_index = None
+latest_neighbour_future = None
+# list box of the reference entries and the (word, phn) entry of each row (a string for headings)
+reference_lbox = None
+reference_rows = []
+
+# live mode: g2p is re-run while typing in the word entry, live_g2p_delay ms after the last keystroke
+live_g2p = True
+live_g2p_delay = 250
+live_g2p_after_id = None
+# the word of the latest g2p request
+g2p_word = None
+# the top g2p variant that was last filled into the phoneme entry
+g2p_top_phn = None
 
 # you can configure key bindings here. Note that we need different ones for Mac,
 # as Cmd is standard for commands (instead of CTRL) and the F1-12 keys are buggy in tkinker on a Mac :/
@@ -69,23 +162,64 @@ if platform.system() == 'Darwin':
 else:
     key_bindings = key_bindings_pc
 
-def load_wordlist(wordlist):
-    wordlist_ret = []
-    with open(wordlist, 'r') as wordlist_reader:
-        for line in wordlist_reader:
-            if line[-1] == '\n':
-                line = line[:-1]
-            wordlist_ret.append(line)
-    return wordlist_ret
+# the todo list is indexed in blocks while the window is already shown
+def load_wordlist_lazily(window, listNodes):
+    num_lines = len(listNodes.model)
+    if listNodes.model.index_more():
+        window.after(1, load_wordlist_lazily, window, listNodes)
+    todo_index.extend(listNodes.model.lines(num_lines, len(listNodes.model)))
+    listNodes.model_changed()
+
+def presynthesize_phns(phns):
+    phns = [phn for phn in phns if phn]
+
+    # requests for variants that are not shown anymore and haven't started yet are dropped,
+    # so that they don't pile up when the user moves on quickly
+    for phn, future in list(pending_synth.items()):
+        if phn not in phns:
+            future.cancel()
+            del pending_synth[phn]
+
+    for phn in phns:
+        if phn not in pending_synth:
+            pending_synth[phn] = synth_executor.submit(tts_client.synthesize, phn, mode='mary')
 
 def play(phn, async_play=True):
-    tts_client.say_phn(phn, async_play=async_play)
+    global latest_play_request
+
+    future = pending_synth.get(phn)
+
+    # a running or finished pre-synthesis is used, a queued one is replaced by a request that doesn't
+    # have to wait for the other variants
+    if future is None or not (future.done() or future.running()):
+        if future is not None:
+            future.cancel()
+            del pending_synth[phn]
+        future = play_executor.submit(tts_client.synthesize, phn, mode='mary')
+
+    latest_play_request += 1
+    play_when_synthesized(latest_play_request, future, async_play)
+
+def play_when_synthesized(request_id, future, async_play):
+    # another play request was made in the meantime
+    if request_id != latest_play_request:
+        return
+
+    if not future.done():
+        main_window.after(synth_poll_interval, play_when_synthesized, request_id, future, async_play)
+        return
+
+    try:
+        wav = future.result()
+        tts_client.play_wav(wav, async_play=async_play)
+    except:
+        mbox.showinfo("Error", "Error in playback. Is MARY running?")
 
 def play_evt(evt, phn):
     play(phn)
 
 def play_text(input_text):
-    tts_client.say_phn(input_text.get())
+    play(input_text.get(), async_play=False)
 
 def play_text_evt(evt, input_text):
     play_text(input_text)
@@ -104,11 +238,9 @@ def onselect_dictbox(evt, input_phn_text, input_word_text):
     cursel = w.curselection()
     if cursel is not None and len(cursel) > 0:
         index = int(cursel[0])
-        value = w.get(index)
+        word, phn = lexicon_model[index]
 
-        print('You selected item %d: "%s"' % (index, value))
-
-        word, phn = value.split(' | ')
+        print('You selected item %d: "%s"' % (index, format_entry(word, phn)))
 
         if input_phn_text:
             input_phn_text.delete(0, END)
@@ -136,6 +268,8 @@ def onselect_wordbox(evt, window, proba_lbls, phn_lbls, phn_play_btns, copy_btns
 
         change_g2p(value, window, proba_lbls, phn_lbls, phn_play_btns, copy_btns, input_phn_text, input_word_text)
 
+        prefetch_todo(w, index, num_variants)
+
 # same as change_g2p_textbox, but allows an event agrument (for key binding)
 def change_g2p_textbox_evt(evt, window, proba_lbls, phn_lbls, phn_play_btns, copy_btns, input_phn_text,
                            input_word_text, num_variants=5):
@@ -149,20 +283,155 @@ def change_g2p_textbox(window, proba_lbls, phn_lbls, phn_play_btns, copy_btns, i
     change_g2p(word, window, proba_lbls, phn_lbls, phn_play_btns, copy_btns, input_phn_text,
                    input_word_text, num_variants)
 
+def get_prefetched(word, num_variants):
+    with prefetch_lock:
+        key = (word, num_variants)
+        if key in prefetch_cache:
+            prefetch_cache.move_to_end(key)
+            return prefetch_cache[key]
+    return None
+
+def prefetch_g2p(words, num_variants):
+    global prefetch_future, prefetch_keys
+
+    # e.g. while scrolling quickly, only the latest batch is still needed
+    if prefetch_future is not None and prefetch_future.cancel():
+        with prefetch_lock:
+            prefetch_pending.difference_update(prefetch_keys)
+        prefetch_future = None
+
+    with prefetch_lock:
+        keys = [(word, num_variants) for word in OrderedDict.fromkeys(words)]
+        keys = [key for key in keys if key not in prefetch_cache and key not in prefetch_pending]
+        prefetch_pending.update(keys)
+
+    if not keys:
+        return
+
+    def run():
+        try:
+            phn_map = g2p_cache.gen_phn_variants_multi(sequitur_model, [word for word, nv in keys], variants=num_variants)
+        except:
+            print("Warning, prefetching g2p variants failed")
+            phn_map = {}
+
+        with prefetch_lock:
+            prefetch_pending.difference_update(keys)
+            for word, phn_input_list in phn_map.items():
+                prefetch_cache[(word, num_variants)] = phn_input_list
+            while len(prefetch_cache) > prefetch_cache_size:
+                prefetch_cache.popitem(last=False)
+
+    prefetch_future = prefetch_executor.submit(run)
+    prefetch_keys = keys
+
+def prefetch_todo(listNodes, index, num_variants=5):
+    size = listNodes.size()
+    words = []
+
+    for i in range(max(0, index - prefetch_around), min(size, index + prefetch_around + 1)):
+        words.append(listNodes.get(i))
+
+    # don't scan the whole rest of the list if most of it is annotated already
+    num_next = 0
+    for i in range(index + 1, min(size, index + 1 + 10 * prefetch_next)):
+        if num_next >= prefetch_next:
+            break
+        word = listNodes.get(i)
+        if word not in lexicon_model:
+            words.append(word)
+            num_next += 1
+
+    prefetch_g2p(words, num_variants)
+
+def request_g2p(word, num_variants, on_result):
+    """Runs g2p for word on g2p_executor, on_result(phn_input_list) is later called on the Tk thread
+       by poll_g2p_results, unless another request was made in the meantime."""
+    global latest_g2p_request, latest_g2p_future
+
+    # a request that hasn't started yet is not needed anymore
+    if latest_g2p_future is not None:
+        latest_g2p_future.cancel()
+
+    latest_g2p_request += 1
+    request_id = latest_g2p_request
+
+    phn_input_list = get_prefetched(word, num_variants)
+    if phn_input_list is not None:
+        latest_g2p_future = None
+        on_result(phn_input_list)
+        return request_id
+
+    future = g2p_executor.submit(g2p_cache.gen_phn_variants, sequitur_model, word, variants=num_variants)
+    future.add_done_callback(lambda f: g2p_results.put((request_id, f, on_result)))
+    latest_g2p_future = future
+
+    return request_id
+
+def poll_g2p_results(window):
+    # rescheduled first, so that a failing callback doesn't stop the polling
+    window.after(g2p_poll_interval, poll_g2p_results, window)
+
+    while True:
+        try:
+            request_id, future, on_result = g2p_results.get_nowait()
+        except queue.Empty:
+            break
+
+        # the user already moved on to another word
+        if request_id != latest_g2p_request or future.cancelled():
+            continue
+
+        try:
+            phn_input_list = future.result()
+        except:
+            print("Warning, automatic translation failed")
+            phn_input_list = []
+
+        on_result(phn_input_list)
+
+# debounce keystrokes in the word entry, g2p runs once typing pauses
+def live_g2p_evt(evt, window, proba_lbls, phn_lbls, phn_play_btns, copy_btns, input_phn_text,
+                 input_word_text, num_variants=5):
+    global live_g2p_after_id
+
+    if live_g2p_after_id is not None:
+        window.after_cancel(live_g2p_after_id)
+
+    live_g2p_after_id = window.after(live_g2p_delay, partial(live_g2p_textbox, window, proba_lbls, phn_lbls,
+                                                             phn_play_btns, copy_btns, input_phn_text,
+                                                             input_word_text, num_variants))
+
+def live_g2p_textbox(window, proba_lbls, phn_lbls, phn_play_btns, copy_btns, input_phn_text,
+                     input_word_text, num_variants=5):
+    global live_g2p_after_id
+    live_g2p_after_id = None
+
+    word = input_word_text.get().strip()
+
+    # e.g. cursor keys or a shortcut, the word didn't change
+    if len(word) == 0 or word == g2p_word:
+        return
+
+    # don't rewrite the word entry while the user is typing in it, and keep a pronunciation
+    # the user chose or edited
+    change_g2p(word, window, proba_lbls, phn_lbls, phn_play_btns, copy_btns, input_phn_text,
+               None, num_variants, keep_phn=True)
+
 # reload automatically generated phoneme entry suggestions
+# with keep_phn, the phoneme entry is only filled with the top variant if it is empty or still
+# holds the previous top variant
 def change_g2p(word, window, proba_lbls, phn_lbls, phn_play_btns, copy_btns, input_phn_text,
-               input_word_text, num_variants=5):
+               input_word_text, num_variants=5, keep_phn=False):
+    global g2p_word
+    g2p_word = word
 
-    # setting g2p proba and text labels to loading
+    # setting g2p proba and text labels to loading, the variants of the previous word can't be used meanwhile
     for row_num in range(num_variants):
-        if row_num == 0:
-            phn_lbls[row_num].config(text='loading...')
-            proba_lbls[row_num].config(text='loading...')
-        else:
-            phn_lbls[row_num].config(text='')
-            proba_lbls[row_num].config(text='')
+        clear_g2p_row(row_num, window, proba_lbls, phn_lbls, phn_play_btns, copy_btns, num_variants,
+                      text='loading...' if row_num == 0 else '')
 
-    if input_phn_text:
+    if input_phn_text and not keep_phn:
         input_phn_text.delete(0, END)
         input_phn_text.insert(0, '')
 
@@ -170,37 +439,128 @@ def change_g2p(word, window, proba_lbls, phn_lbls, phn_play_btns, copy_btns, inp
         input_word_text.delete(0, END)
         input_word_text.insert(0, word)
 
-    # basically flush changes
-    window.update_idletasks()
+    request_id = request_g2p(word, num_variants, partial(show_g2p, window=window, proba_lbls=proba_lbls,
+                                                         phn_lbls=phn_lbls, phn_play_btns=phn_play_btns,
+                                                         copy_btns=copy_btns, input_phn_text=input_phn_text,
+                                                         num_variants=num_variants, keep_phn=keep_phn))
 
-    phn_input_list = sequiturclient.sequitur_gen_phn_variants(sequitur_model, word, variants=num_variants)
+    show_reference(word, request_id)
+
+# F6-F10 copy the variants, or cmd+6 - cmd+0 on Mac
+def copy_bind_num(row_num, num_variants):
+    bind_num = 10 - num_variants + row_num+1
+    if platform.system() == 'Darwin' and bind_num == 10:
+        bind_num = 0
+    return bind_num
+
+# empty variant row: labels are blanked, buttons and hot keys do nothing
+def clear_g2p_row(row_num, window, proba_lbls, phn_lbls, phn_play_btns, copy_btns, num_variants=5, text=''):
+    phn_lbls[row_num].config(text=text)
+    proba_lbls[row_num].config(text=text)
+    phn_play_btns[row_num+1].config(command='', state=DISABLED)
+    copy_btns[row_num].config(command='', state=DISABLED)
+
+    window.unbind(key_bindings["number_key"][0] % (row_num+1))
+    window.unbind(key_bindings["number_key"][0] % copy_bind_num(row_num, num_variants))
+
+# show the g2p variants of change_g2p, called on the Tk thread once they are computed
+def show_g2p(phn_input_list, window, proba_lbls, phn_lbls, phn_play_btns, copy_btns, input_phn_text, num_variants=5,
+             keep_phn=False):
+    global g2p_top_phn
 
     for row_num in range(num_variants):
+        # rows without a variant must not play or copy the variants of the previous word
+        if row_num >= len(phn_input_list):
+            clear_g2p_row(row_num, window, proba_lbls, phn_lbls, phn_play_btns, copy_btns, num_variants)
+            continue
+
         phn_lbls[row_num].config(text=phn_input_list[row_num]['phn'])
         proba_lbls[row_num].config(text=phn_input_list[row_num]['proba'])
-        phn_play_btns[row_num+1].config(command=partial(play, phn_input_list[row_num]['phn']))
-        copy_btns[row_num].config(command=partial(copy, phn_input_list[row_num]['phn'], input_phn_text))
+        phn_play_btns[row_num+1].config(command=partial(play, phn_input_list[row_num]['phn']), state=NORMAL)
+        copy_btns[row_num].config(command=partial(copy, phn_input_list[row_num]['phn'], input_phn_text), state=NORMAL)
 
         window.bind(key_bindings["number_key"][0] % (row_num+1), partial(play_evt, phn=phn_input_list[row_num]['phn']))
+        window.bind(key_bindings["number_key"][0] % copy_bind_num(row_num, num_variants),
+                    partial(copy_evt, phn=phn_input_list[row_num]['phn'], input_text=input_phn_text))
 
-        bind_num = 10 - num_variants + row_num+1
-        if platform.system() == 'Darwin' and bind_num == 10:
-            bind_num = 0
-
-        window.bind(key_bindings["number_key"][0] % bind_num, partial(copy_evt,
-                                                                             phn=phn_input_list[row_num]['phn'],
-                                                                             input_text=input_phn_text))
-
-    if input_phn_text:
+    if input_phn_text and len(phn_input_list) > 0 and \
+            (not keep_phn or input_phn_text.get() in ('', g2p_top_phn)):
         input_phn_text.delete(0, END)
         input_phn_text.insert(0, phn_input_list[0]['phn'])
+        g2p_top_phn = phn_input_list[0]['phn']
+
+    if presynthesize:
+        presynthesize_phns([phn['phn'] for phn in phn_input_list[:num_variants]] +
+                           ([input_phn_text.get()] if input_phn_text else []))
+
+# show the reference lexicon entries of word and of its prefix siblings. The words with similar spelling are
+# searched on g2p_executor and shown once they are found, as part of the g2p request request_id
+def show_reference(word, request_id):
+    global latest_neighbour_future
+
+    if reference_lbox is None or reference_lexicon is None:
+        return
+
+    sections = [("-- %s --" % word, reference_lexicon.lookup(word)),
+                ("-- similar spelling --", []),
+                ("-- same prefix --", reference_lexicon.siblings(word, limit=num_reference_siblings)),
+                ("-- same ending --", reference_lexicon.suffix_siblings(word, limit=num_reference_siblings))]
+    show_reference_sections(sections)
+
+    # a search for a previous word that hasn't started yet is not needed anymore
+    if latest_neighbour_future is not None:
+        latest_neighbour_future.cancel()
+        latest_neighbour_future = None
+
+    if neighbour_index is not None:
+        future = g2p_executor.submit(neighbour_index.neighbours, word, k=num_neighbours)
+        future.add_done_callback(lambda f: g2p_results.put((request_id, f, partial(show_neighbours, sections=sections))))
+        latest_neighbour_future = future
+
+def show_neighbours(neighbours, sections):
+    sections[1] = ("-- similar spelling --", [(neighbour, phn) for neighbour, phn, distance in neighbours])
+    show_reference_sections(sections)
+
+def show_reference_sections(sections):
+    reference_rows[:] = []
+    for heading, entries in sections:
+        if entries:
+            reference_rows.append(heading)
+            reference_rows.extend(entries)
+
+    reference_lbox.delete(0, END)
+    reference_lbox.insert(END, *[row if isinstance(row, str) else format_entry(*row) for row in reference_rows])
+
+def load_reference_lexicon():
+    global reference_lexicon, neighbour_index
+
+    reference_lexicon = reflexicon.ReferenceLexicon(reference_lexicons, reference_index_file)
+    neighbour_index = reflexicon.NeighbourIndex(reference_lexicon)
+
+def onselect_reference(evt, input_phn_text):
+    cursel = reference_lbox.curselection()
+    if cursel is None or len(cursel) == 0 or isinstance(reference_rows[int(cursel[0])], str):
+        return
+
+    word, phn = reference_rows[int(cursel[0])]
+    copy(phn, input_phn_text)
+
+    try:
+        play(phn, async_play=True)
+    except:
+        mbox.showinfo("Error", "Error in playback. Is MARY running?")
 
 # delete one entry form the dictionary list box
 def delete_entry(listDict):
-    listDict.delete(ACTIVE)
+    if len(lexicon_model) == 0:
+        return
+    word, phn = lexicon_model.delete(listDict.index(ACTIVE))
     if auto_save:
         print("Active entry deleted.")
-        save(listDict, output_lexicon)
+        if journaled_save:
+            lexicon_journal.delete(word, phn)
+        else:
+            save(output_lexicon)
 
 def next_selection(listNodes):
     selection_indices = listNodes.curselection()
@@ -230,11 +590,23 @@ def next_selection(listNodes):
 
 # add an element and automatically select the next one
 def add_and_next(listDict, listNodes, input_word_text, input_phn_text):
-    entry = input_word_text.get() + ' | ' + input_phn_text.get()
-    listDict.insert(END, entry)
+    word = input_word_text.get()
+    phn = input_phn_text.get()
+
+    if lexicon_model.has_entry(word, phn):
+        if not mbox.askyesno('Duplicate', '"%s" is already in the dictionary. Add it again?' % format_entry(word, phn)):
+            return
+    elif word in lexicon_model:
+        print("Note: %s already has the pronunciation(s): %s" % (word, ", ".join(lexicon_model.pronunciations(word))))
+
+    lexicon_model.append(word, phn)
+    listDict.see(END)
     if auto_save:
-        print("Added entry:" + entry)
-        save(listDict, output_lexicon)
+        print("Added entry:" + format_entry(word, phn))
+        if journaled_save:
+            lexicon_journal.add(word, phn)
+        else:
+            save(output_lexicon)
 
     sel_id = next_selection(listNodes)
     print('Add and next: selecting new element with id', sel_id)
@@ -242,52 +614,75 @@ def add_and_next(listDict, listNodes, input_word_text, input_phn_text):
 def add_and_next_evt(evt, listDict, listNodes, input_word_text, input_phn_text):
     add_and_next(listDict, listNodes, input_word_text, input_phn_text)
 
-def save(listDict, filename):
+# (word, phn) -> "word | phn" entry of the dictionary list box
+def format_entry(word, phn):
+    return word + ' | ' + phn
+
+# keeps a virtual list box in sync with the changes of lexicon_model
+def listbox_listener(listbox):
+    def on_change(op, index, entries):
+        listbox.model_changed(op, index, len(entries))
+    return on_change
+
+# keeps a search index in sync with the words (field=0) or pronunciations (field=1) of lexicon_model
+def search_index_listener(index, field):
+    def on_change(op, pos, entries):
+        if op == 'insert':
+            index.extend(entry[field] for entry in entries)
+        elif op == 'delete':
+            for entry in entries:
+                index.delete(pos)
+    return on_change
+
+lexicon_model.add_listener(search_index_listener(lexicon_word_index, 0))
+lexicon_model.add_listener(search_index_listener(lexicon_phn_index, 1))
+
+def save(filename):
     print("Saving dictionary to:", filename)
-    all_items = listDict.get(0, END)
-    print("Dictionary is:", all_items)
     with open(filename, 'w') as out_file:
-        for elem in all_items:
-            split = elem.split(' | ')
-            word = split[0]
-            phns = ' | '.join(split[1:])
-            print(word, phns)
+        for word, phns in lexicon_model:
             out_file.write(word + ' ' + phns + '\n')
+    print("Saved %d entries." % len(lexicon_model))
 
-def load(listDict, filename):
+# write a new snapshot of output_lexicon and start a new journal
+def compact_lexicon(wait=False):
+    if lexicon_journal.num_ops > 0 or wait:
+        lexicon_journal.compact(lexicon_model, wait=wait)
 
-    if os.path.isfile(filename):
-        print("Loading dictionary from:", filename)
-        with open(filename, 'r') as in_file:
-            for line in in_file:
+def compact_lexicon_periodically(window):
+    compact_lexicon()
+    window.after(compact_interval, compact_lexicon_periodically, window)
 
-                if line[-1] == '\n':
-                    line = line[:-1]
-                split = line.split(" ")
-                word = split[0]
-                phn = " ".join(split[1:])
+def load(filename):
 
-                listDict.insert(END, word + " | " + phn)
+    if journaled_save and filename == output_lexicon:
+        print("Loading dictionary and journal from:", filename)
+        lexicon_model.extend(lexicon_journal.load())
+    elif os.path.isfile(filename):
+        print("Loading dictionary from:", filename)
+        lexicon_model.extend(lexicon.read_lexicon(filename))
     else:
         print("Warning, not loading dictionary since there was none:", filename)
 
-def search_listdict(search_string, listDict_items, exact_match=False, split=''):
-    search_index = -1
-
-    # case insensitive search
-    search_string = search_string.lower()
-
-    for i, elem in enumerate(listDict_items):
-        if exact_match:
-            if elem.lower() == search_string:
-                search_index = i
-                return search_index
-        else:
-            if search_string in elem.lower():
-                search_index = i
-                return search_index
+# index of the next match of query in a list box, starting at its selection.
+# direction 0 includes the selected entry (search as you type), 1 and -1 go to the next/previous match
+def search_listbox(listbox, index, query, mode, direction=0):
+    selection = listbox.curselection()
+    current = int(selection[0]) if len(selection) > 0 else -1
+
+    if direction < 0:
+        start = current - 1 if current > 0 else len(index) - 1
+        found = index.find(query, start, backward=True, mode=mode)
+        # wrap around
+        if found == -1:
+            found = index.find(query, len(index) - 1, backward=True, mode=mode)
+    else:
+        start = max(0, current + direction)
+        found = index.find(query, start, mode=mode)
+        if found == -1 and start > 0:
+            found = index.find(query, 0, mode=mode)
 
-    return search_index
+    return found
 
 def setSelection(listDict, i):
     selection_indices = listDict.curselection()
@@ -296,66 +691,90 @@ def setSelection(listDict, i):
         listDict.selection_clear(selection_indices)
     listDict.activate(i)
     listDict.selection_set(i)
+    listDict.see(i)
     #listDict.event_generate("<<ListboxSelect>>", when="tail")
 
-def search_listboxes(window, listDict, listNodes):
-    search_string = simpledialog.askstring("Search", "Input search string:",
-                                    parent=window)
+# searches the todo list and the dictionary. "^word" finds exact matches of word, in regex mode ^ and $ match
+# at the beginning and end of the entries. Matching entries are selected, no match turns the search box red
+def search_listboxes(search_text, search_mode, listDict, listNodes, direction=0):
+    query = search_text.get()
+    mode = search_mode.get()
 
-    if search_string is None or len(search_string) == 0:
+    if len(query) == 0:
+        search_text.config(background=search_background)
         return
 
-    exact_match = False
-    if search_string[0] == '^':
-        exact_match = True
-
-    listDict_items = [elem.split(' | ')[0] for elem in listDict.get(0, END)]
-    #print("listDict_items", listDict_items)
-    listDict_index = search_listdict(search_string, listDict_items, exact_match)
-
-    listNodes_items = listNodes.get(0, END)
-    #print("listNodes_items:",listNodes_items)
-    listNodes_index = search_listdict(search_string, listNodes_items, exact_match)
-
-    # found matching element, first select on nodes
-    if listNodes_index != -1:
-        setSelection(listNodes, listNodes_index)
+    if mode == "regex":
+        find_mode = "regex"
+    elif query[0] == '^':
+        find_mode = "exact"
+        query = query[1:]
     else:
-        print(search_string, "not found")
+        find_mode = "substring"
 
-    # found matching element, then on dict (might clear the selection in nodes though)
-    if listDict_index != -1:
-        setSelection(listDict, listDict_index)
+    if mode == "pronunciation":
+        targets = [(listDict, lexicon_phn_index)]
     else:
-        print(search_string, "not found")
-
-def search_listboxes_evt(evt, window, listDict, listNodes):
-    return search_listboxes(window, listDict, listNodes)
+        targets = [(listNodes, todo_index), (listDict, lexicon_word_index)]
 
-def save_and_exit(listDict):
-    save(listDict, output_lexicon)
+    found = False
+    for listbox, index in targets:
+        try:
+            i = search_listbox(listbox, index, query, find_mode, direction)
+        except re.error:
+            # e.g. an incomplete regex while typing
+            break
+        if i != -1:
+            setSelection(listbox, i)
+            found = True
+
+    if not found:
+        print(query, "not found")
+    search_text.config(background=search_background if found else "#ffc0c0")
+
+# search as you type, only if the query changed (not for navigation keys)
+def search_as_you_type_evt(evt, search_text, search_mode, listDict, listNodes):
+    global last_search_query
+    if search_text.get() != last_search_query:
+        last_search_query = search_text.get()
+        search_listboxes(search_text, search_mode, listDict, listNodes)
+
+def search_next_evt(evt, search_text, search_mode, listDict, listNodes, direction=1):
+    search_listboxes(search_text, search_mode, listDict, listNodes, direction)
+    return "break"
+
+def focus_search_evt(evt, search_text):
+    search_text.focus_set()
+    search_text.select_range(0, END)
+
+def save_and_exit():
+    if journaled_save:
+        compact_lexicon(wait=True)
+    else:
+        save(output_lexicon)
     if mbox.askyesno('Verify', 'Do you really want to quit?'):
         sys.exit()
     else:
         mbox.showinfo('No', 'Quit has been cancelled')
 
-def backup(listDict):
+def backup():
     now = datetime.now()
     dt_string = now.strftime("%Y_%m_%d____%H_%M_%S")
     filename = "backup_" + dt_string + ".dict"
-    save(listDict, "dicts/" + filename)
+    save("dicts/" + filename)
 
-def backup_evt(evt,listDict):
-    backup(listDict)
+def backup_evt(evt):
+    backup()
 
 def start_window(num_variants=5):
+    global search_background, reference_lbox, main_window
+
     window = Tk()
+    main_window = window
 
     window.title("Speech lex edit")
     window.geometry('1100x800')
 
-    phn_input_list = sequiturclient.sequitur_gen_phn_variants(sequitur_model, "test", variants=num_variants)
-
     proba_lbls = []
     phn_lbls = []
     phn_play_btns = []
@@ -381,11 +800,11 @@ def start_window(num_variants=5):
 
     # Labels (probability, auto phoneme sequence) + play + copy buttons for all phoneme variants (usually 5)
     for row_num in range(num_variants):
-        proba_lbl = Label(window, text=phn_input_list[row_num]['proba'])
+        proba_lbl = Label(window, text='')
         proba_lbl.grid(column=0, row=row_num+row_num_offet)
         proba_lbls.append(proba_lbl)
 
-        lbl = Label(window, text=phn_input_list[row_num]['phn'])
+        lbl = Label(window, text='')
 
         lbl.grid(column=1, row=row_num+row_num_offet)
 
@@ -397,11 +816,7 @@ def start_window(num_variants=5):
         phn_play_btns.append(play_btn)
 
         # also bind to F6-F10 hot keys, or cmd+6 - cmd+0 on Mac
-        bind_num = 10 - num_variants + row_num+1
-        if platform.system() == 'Darwin' and bind_num == 10:
-            bind_num = 0
-
-        copy_btn = Button(window, text="Copy ("+key_bindings["number_key"][1] % bind_num+")")
+        copy_btn = Button(window, text="Copy ("+key_bindings["number_key"][1] % copy_bind_num(row_num, num_variants)+")")
         copy_btn.grid(column=3, row=row_num+row_num_offet)
         copy_btns.append(copy_btn)
 
@@ -414,12 +829,9 @@ def start_window(num_variants=5):
     scrollbar = Scrollbar(frm, orient="vertical")
     scrollbar.pack(side=RIGHT, fill=Y)
 
-    listNodes = Listbox(frm, width=20, yscrollcommand=scrollbar.set, font=("Helvetica", 12))
+    listNodes = virtuallist.VirtualListbox(frm, virtuallist.LazyLines(todo_wordlist), width=20, exportselection=False,
+                                           yscrollcommand=scrollbar.set, font=("Helvetica", 12))
     listNodes.pack(expand=True, fill=Y)
-    listNodes.bind('<<ListboxSelect>>', partial(onselect_wordbox, window=window, proba_lbls=proba_lbls,
-                                                phn_lbls=phn_lbls, phn_play_btns=phn_play_btns, copy_btns=copy_btns,
-                                                input_phn_text=input_phn_text, input_word_text=input_word_text,
-                                                num_variants=num_variants))
     scrollbar.config(command=listNodes.yview)
 
     frm2 = Frame(window)
@@ -428,19 +840,25 @@ def start_window(num_variants=5):
     scrollbar2 = Scrollbar(frm2, orient="vertical")
     scrollbar2.pack(side=RIGHT, fill=Y)
 
-    listDict = Listbox(frm2, height=20,  width=40, yscrollcommand=scrollbar2.set, font=("Helvetica", 12))
+    listDict = virtuallist.VirtualListbox(frm2, lexicon_model, formatter=lambda entry: format_entry(*entry),
+                                          height=20, width=40, exportselection=False, yscrollcommand=scrollbar2.set, font=("Helvetica", 12))
     listDict.pack(expand=True, fill=Y)
     listDict.bind('<<ListboxSelect>>', partial(onselect_dictbox, input_phn_text=input_phn_text,
                                                input_word_text=input_word_text))
+
+    listNodes.bind('<<ListboxSelect>>', partial(onselect_wordbox, window=window, proba_lbls=proba_lbls,
+                                                phn_lbls=phn_lbls, phn_play_btns=phn_play_btns, copy_btns=copy_btns,
+                                                input_phn_text=input_phn_text, input_word_text=input_word_text,
+                                                num_variants=num_variants))
 #    listSelection.grid(row=1, column=1, sticky=E + W + N)
 
     scrollbar2.config(command=listDict.yview)
 
-    for x in load_wordlist(todo_wordlist):
-        listNodes.insert(END, x)
+    load_wordlist_lazily(window, listNodes)
 
     # Load the current dictionary in output_lexicon into th GUI
-    load(listDict, output_lexicon)
+    lexicon_model.add_listener(listbox_listener(listDict))
+    load(output_lexicon)
 
     add_and_next_btn = Button(window, text="Add&Next ("+key_bindings["add_and_next"][1]+")", command=partial(add_and_next, listDict=listDict,
                                                                                 listNodes=listNodes,
@@ -454,13 +872,13 @@ def start_window(num_variants=5):
     delete_btn = Button(window, text="Delete Entry", command=partial(delete_entry, listDict))
     delete_btn.grid(column=2, row=1)
 
-    save_and_exit_btn = Button(window, text="Save&Exit", command=partial(save_and_exit, listDict))
+    save_and_exit_btn = Button(window, text="Save&Exit", command=save_and_exit)
     save_and_exit_btn.grid(column=3, row=1)
 
-    backup_btn = Button(window, text="Backup ("+key_bindings["backup_btn"][1]+")", command=partial(backup, listDict))
+    backup_btn = Button(window, text="Backup ("+key_bindings["backup_btn"][1]+")", command=backup)
     backup_btn.grid(column=4, row=1)
 
-    window.bind(key_bindings["backup_btn"][0], partial(backup_evt, listDict=listDict))
+    window.bind(key_bindings["backup_btn"][0], backup_evt)
 
     reload_g2p_btn = Button(window, text="↻G2P ("+key_bindings["change_g2p_textbox"][1]+")", command=partial(change_g2p_textbox,  window=window,
                                                                  proba_lbls=proba_lbls, phn_lbls=phn_lbls,
@@ -476,9 +894,61 @@ def start_window(num_variants=5):
 
     reload_g2p_btn.grid(column=4, row=8)
 
+    reference_lbl = Label(window, text="Reference lexicon (click to copy):")
+    reference_lbl.grid(column=0, row=9, sticky=W)
+
+    reference_lbox = Listbox(window, height=12, width=60, exportselection=False, font=("Helvetica", 12))
+    reference_lbox.grid(column=0, row=10, columnspan=4, sticky=W + E)
+    reference_lbox.bind('<<ListboxSelect>>', partial(onselect_reference, input_phn_text=input_phn_text))
+
+    if live_g2p:
+        input_word_text.bind('<KeyRelease>', partial(live_g2p_evt, window=window,
+                                                     proba_lbls=proba_lbls, phn_lbls=phn_lbls,
+                                                     phn_play_btns=phn_play_btns, copy_btns=copy_btns,
+                                                     input_phn_text=input_phn_text,
+                                                     input_word_text=input_word_text,
+                                                     num_variants=num_variants))
+
     change_g2p("test", window, proba_lbls, phn_lbls, phn_play_btns, copy_btns, input_phn_text, input_word_text)
 
-    window.bind(key_bindings["find_btn_hotkey"][0], partial(search_listboxes_evt, window=window, listDict=listDict, listNodes=listNodes))
+    # search bar, searches as you type, Return / Shift+Return go to the next / previous match
+    search_frm = Frame(window)
+    search_frm.grid(row=0, column=0, columnspan=5, sticky=W)
+
+    search_lbl = Label(search_frm, text="Find ("+key_bindings["find_btn_hotkey"][1]+"):")
+    search_lbl.pack(side=LEFT)
+
+    search_text = Entry(search_frm, width=30)
+    search_text.pack(side=LEFT)
+    search_background = search_text.cget("background")
+
+    search_mode = StringVar(window, value=search_modes[0])
+    search_mode_menu = OptionMenu(search_frm, search_mode, *search_modes,
+                                  command=lambda mode: search_listboxes(search_text, search_mode, listDict, listNodes))
+    search_mode_menu.pack(side=LEFT)
+
+    search_prev_btn = Button(search_frm, text="▲", command=partial(search_listboxes, search_text, search_mode,
+                                                                  listDict, listNodes, -1))
+    search_prev_btn.pack(side=LEFT)
+    search_next_btn = Button(search_frm, text="▼", command=partial(search_listboxes, search_text, search_mode,
+                                                                  listDict, listNodes, 1))
+    search_next_btn.pack(side=LEFT)
+
+    search_text.bind('<KeyRelease>', partial(search_as_you_type_evt, search_text=search_text, search_mode=search_mode,
+                                             listDict=listDict, listNodes=listNodes))
+    search_text.bind('<Return>', partial(search_next_evt, search_text=search_text, search_mode=search_mode,
+                                         listDict=listDict, listNodes=listNodes, direction=1))
+    search_text.bind('<Shift-Return>', partial(search_next_evt, search_text=search_text, search_mode=search_mode,
+                                               listDict=listDict, listNodes=listNodes, direction=-1))
+
+    window.bind(key_bindings["find_btn_hotkey"][0], partial(focus_search_evt, search_text=search_text))
+
+    poll_g2p_results(window)
+
+    threading.Thread(target=load_reference_lexicon, daemon=True).start()
+
+    if journaled_save:
+        window.after(compact_interval, compact_lexicon_periodically, window)
 
     window.mainloop()
 
@@ -58,7 +58,8 @@ class TTS(object):
                  engine='mary',
                  voice=DEFAULT_MARY_VOICE,
                  pitch=50,  # 0-99
-                 speed=175):  # approx. words per minute
+                 speed=175,  # approx. words per minute
+                 wav_cache=None):  # optional wavcache.WavCache
 
         self._host_tts = host_tts
         self._port_tts = port_tts
@@ -67,6 +68,7 @@ class TTS(object):
         self._voice = voice
         self._pitch = pitch
         self._speed = speed
+        self._wav_cache = wav_cache
 
         if host_tts == 'local':
             self.marytts = MaryTTS()
@@ -113,8 +115,31 @@ class TTS(object):
     def speed(self, v):
         self._speed = v
 
+    @property
+    def wav_cache(self):
+        return self._wav_cache
+
+    @wav_cache.setter
+    def wav_cache(self, v):
+        self._wav_cache = v
+
     def synthesize(self, txt, mode='txt'):
 
+        if self._wav_cache:
+            wav = self._wav_cache.get(self._engine, self._voice, self._locale, mode, txt)
+            if wav:
+                logging.debug('synthesize: %s %s -> cached WAV' % (txt, mode))
+                return wav
+
+        wav = self._synthesize(txt, mode)
+
+        if wav and self._wav_cache:
+            self._wav_cache.put(self._engine, self._voice, self._locale, mode, txt, wav)
+
+        return wav
+
+    def _synthesize(self, txt, mode):
+
         if self._host_tts == 'local':
 
             # import pdb; pdb.set_trace()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2019 Benjamin Milde (Universitaet Hamburg)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# Validates lexicon files ("word phn phn phn", e.g. dicts/lexicon_de_mary.txt or output_lexicon.txt)
+# against the phoneme inventory of phonetics.big_phoneme_table, using all cores.
+# Offending lines are printed as filename:line:column: message, the exit code is 1 if there were errors.
+#
+#   python3 validate_lexicon.py dicts/lexicon_de_mary.txt output_lexicon.txt
+#
+
+import sys
+import argparse
+import itertools
+import multiprocessing
+
+from phonetics import phoneme_inventory
+
+STRESS_MARKS = "',"
+FORMAT_IDX = {'mary': 2, 'xsampa': 1}
+
+chunk_size = 10000
+
+_inventory = None
+
+
+def _init_worker(fmt):
+    global _inventory
+    _inventory = phoneme_inventory(FORMAT_IDX[fmt])
+    # stress marks are only valid as prefix of a phoneme, see validate_phoneme
+    _inventory.difference_update(STRESS_MARKS)
+
+
+def validate_phoneme(token, col):
+    errors = []
+
+    i = 0
+    while i < len(token) and token[i] in STRESS_MARKS:
+        i += 1
+
+    if i > 1:
+        errors.append((col, "multiple stress marks in '%s'" % token))
+
+    body = token[i:]
+
+    if len(body) == 0:
+        errors.append((col, "stress mark without phoneme"))
+        return errors
+
+    for j, c in enumerate(body):
+        if c in STRESS_MARKS:
+            errors.append((col + i + j, "misplaced stress mark in '%s'" % token))
+            return errors
+
+    # length mark and nasalization (dropped by the XSAMPA normalization) are allowed after a phoneme
+    if body[-1] == ':':
+        body = body[:-1]
+    if body not in _inventory and body[-1:] == '~':
+        body = body[:-1]
+
+    if body not in _inventory:
+        errors.append((col + i, "unknown phoneme '%s'" % token[i:]))
+
+    return errors
+
+
+def validate_line(line):
+    """Returns a list of (column, message) tuples, columns start at 1."""
+    word, sep, phns = line.partition(' ')
+
+    if len(word) == 0:
+        return [(1, "missing word")]
+
+    if len(phns.strip()) == 0:
+        return [(len(word) + 1, "missing pronunciation")]
+
+    errors = []
+    col = len(word) + 2
+
+    for token in phns.split(' '):
+        if len(token) == 0:
+            errors.append((col, "empty phoneme (double space)"))
+        else:
+            errors += validate_phoneme(token, col)
+        col += len(token) + 1
+
+    return errors
+
+
+def validate_chunk(chunk):
+    results = []
+
+    for lineno, line in chunk:
+        errors = validate_line(line)
+        if errors:
+            results.append((lineno, line, errors))
+
+    return results
+
+
+def read_chunks(filename):
+    with open(filename, encoding='utf8') as in_file:
+        lines = ((lineno, line.rstrip('\n')) for lineno, line in enumerate(in_file, 1))
+        while True:
+            chunk = list(itertools.islice(lines, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+
+def validate_lexicon(filename, pool):
+    num_errors = 0
+
+    for results in pool.imap(validate_chunk, read_chunks(filename)):
+        for lineno, line, errors in results:
+            for col, msg in errors:
+                print("%s:%d:%d: %s | %s" % (filename, lineno, col, msg, line))
+            num_errors += len(errors)
+
+    return num_errors
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Validates lexicon files against the phoneme inventory.')
+    parser.add_argument('lexicons', nargs='+', help='lexicon files, one "word phn phn ..." entry per line')
+    parser.add_argument('--format', choices=sorted(FORMAT_IDX), default='mary', help='phoneme set of the lexicons')
+    parser.add_argument('--jobs', type=int, default=multiprocessing.cpu_count(), help='number of worker processes')
+
+    args = parser.parse_args()
+
+    num_errors = 0
+
+    with multiprocessing.Pool(args.jobs, initializer=_init_worker, initargs=(args.format,)) as pool:
+        for filename in args.lexicons:
+            num_errors += validate_lexicon(filename, pool)
+
+    print("%d errors in %s" % (num_errors, ", ".join(args.lexicons)), file=sys.stderr)
+
+    sys.exit(1 if num_errors > 0 else 0)
@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2019 Benjamin Milde (Universitaet Hamburg)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# Virtualized list box for long word lists and lexicons in the editor
+#
+# VirtualListbox only holds the visible rows in its Tk Listbox and renders them from a backing
+# model, any object with __len__ and __getitem__ (a list, lexicon.Lexicon, LazyLines). It implements
+# the subset of the Listbox interface used by speech_lex_edit.py, with indices into the model.
+# LazyLines is a model for large text files, its lines are indexed in blocks and read on demand.
+#
+
+import os
+import mmap
+
+from array import array
+from operator import add
+from itertools import accumulate, chain, islice, repeat
+
+from tkinter import Frame, Listbox, ACTIVE, ANCHOR, END, BOTH
+from tkinter import font as tkfont
+
+
+class LazyLines(object):
+    """Read-only sequence of the lines of a text file. Only the start offsets of the lines are kept
+       in memory, index_more() indexes the next block of the file, so that a long file can be indexed
+       in the background while the first lines are already shown."""
+
+    def __init__(self, filename, encoding='utf8'):
+
+        self._encoding = encoding
+        self._file = open(filename, 'rb')
+        self._size = os.fstat(self._file.fileno()).st_size
+        # mmap doesn't support empty files
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self._size > 0 else b''
+
+        # line i is self._data[offsets[i]:offsets[i + 1] - 1]
+        self._offsets = array('q', [0])
+        self._pos = 0
+
+    @property
+    def complete(self):
+        return self._pos >= self._size
+
+    def index_more(self, num_bytes=4 * 1024 * 1024):
+        """Indexes about num_bytes more of the file. Returns False if the file is completely indexed."""
+        if self.complete:
+            return False
+
+        end = min(self._size, self._pos + num_bytes)
+        if end < self._size:
+            # only index complete lines
+            nl = self._data.rfind(b'\n', self._pos, end)
+            if nl == -1:
+                nl = self._data.find(b'\n', end)
+            end = self._size if nl == -1 else nl + 1
+
+        block = self._data[self._pos:end]
+        lines = block.split(b'\n')
+        if block.endswith(b'\n'):
+            lines.pop()
+
+        # cumulative line lengths (+ newline) are the next start offsets, computed without a python loop
+        self._offsets.extend(islice(accumulate(chain((self._pos,), map(add, map(len, lines), repeat(1)))), 1, None))
+        self._pos = end
+
+        return not self.complete
+
+    def index_all(self):
+        while self.index_more():
+            pass
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError('line index out of range')
+
+        line = self._data[self._offsets[i]:self._offsets[i + 1] - 1].decode(self._encoding)
+        if line[-1:] == '\r':
+            line = line[:-1]
+        return line
+
+    def lines(self, first, last):
+        """The lines first to last - 1, decoded at once."""
+        if first >= last:
+            return []
+        block = self._data[self._offsets[first]:self._offsets[last] - 1].decode(self._encoding)
+        return [line[:-1] if line[-1:] == '\r' else line for line in block.split('\n')]
+
+    def close(self):
+        if self._size > 0:
+            self._data.close()
+        self._file.close()
+
+
+class VirtualListbox(Frame):
+    """Listbox that renders only its visible rows, formatter(model[i]) is the text of row i. Supports
+       a single selection. Call model_changed() after the model was modified."""
+
+    def __init__(self, master, model=(), formatter=str, yscrollcommand=None, **kw):
+        Frame.__init__(self, master)
+
+        self._model = model
+        self._formatter = formatter
+        self._yscrollcommand = yscrollcommand
+
+        # first visible model index and number of visible rows
+        self._top = 0
+        self._rows = int(kw.get('height', 10))
+
+        self._selection = None
+        self._active = 0
+
+        self._listbox = Listbox(self, **kw)
+        self._listbox.pack(expand=True, fill=BOTH)
+
+        self._listbox.bind('<<ListboxSelect>>', self._on_select)
+        self._listbox.bind('<Configure>', self._on_configure)
+
+        self._listbox.bind('<Up>', lambda evt: self._move(-1))
+        self._listbox.bind('<Down>', lambda evt: self._move(1))
+        self._listbox.bind('<Prior>', lambda evt: self._move(-self._rows))
+        self._listbox.bind('<Next>', lambda evt: self._move(self._rows))
+        self._listbox.bind('<Control-Home>', lambda evt: self._move(-len(self._model)))
+        self._listbox.bind('<Control-End>', lambda evt: self._move(len(self._model)))
+
+        self._listbox.bind('<MouseWheel>', self._on_mousewheel)
+        self._listbox.bind('<Button-4>', lambda evt: self.yview('scroll', -3, 'units') or 'break')
+        self._listbox.bind('<Button-5>', lambda evt: self.yview('scroll', 3, 'units') or 'break')
+
+        self._render()
+
+    @property
+    def model(self):
+        return self._model
+
+    def _row_height(self):
+        linespace = tkfont.Font(root=self, font=self._listbox.cget('font')).metrics('linespace')
+        return linespace + 1 + 2 * int(self._listbox.cget('selectborderwidth'))
+
+    def _render(self):
+        n = len(self._model)
+        self._top = max(0, min(self._top, n - self._rows))
+        end = min(n, self._top + self._rows)
+
+        self._listbox.delete(0, END)
+        if end > self._top:
+            self._listbox.insert(0, *[self._formatter(self._model[i]) for i in range(self._top, end)])
+
+        if self._selection is not None and self._top <= self._selection < end:
+            self._listbox.selection_set(self._selection - self._top)
+        if self._top <= self._active < end:
+            self._listbox.activate(self._active - self._top)
+
+        if self._yscrollcommand:
+            if n == 0:
+                self._yscrollcommand(0.0, 1.0)
+            else:
+                self._yscrollcommand(self._top / n, end / n)
+
+    def _on_select(self, evt):
+        cursel = self._listbox.curselection()
+        if cursel:
+            self._selection = self._active = self._top + int(cursel[0])
+        elif self._selection is not None and self._top <= self._selection < self._top + self._rows:
+            # e.g. cleared because another list box took over the X selection
+            self._selection = None
+
+        self.event_generate('<<ListboxSelect>>')
+
+    def _on_configure(self, evt):
+        border = int(self._listbox.cget('borderwidth')) + int(self._listbox.cget('highlightthickness'))
+        rows = max(1, (evt.height - 2 * border) // self._row_height())
+        if rows != self._rows:
+            self._rows = rows
+            self._render()
+
+    def _on_mousewheel(self, evt):
+        self.yview('scroll', -3 if evt.delta > 0 else 3, 'units')
+        return 'break'
+
+    def _move(self, delta):
+        n = len(self._model)
+        if n > 0:
+            current = self._selection if self._selection is not None else self._active
+            self._selection = self._active = max(0, min(n - 1, current + delta))
+            self.see(self._selection)
+            self.event_generate('<<ListboxSelect>>')
+        return 'break'
+
+    def model_changed(self, op='update', index=0, count=0):
+        """Keeps selection and active row on the same entries after count entries were inserted
+           (op='insert') or deleted (op='delete') at index, then renders the visible rows again."""
+        if op == 'insert':
+            if self._selection is not None and self._selection >= index:
+                self._selection += count
+            # the active row of an empty list stays on the first row
+            if self._active >= index and len(self._model) > count:
+                self._active += count
+        elif op == 'delete':
+            if self._selection is not None:
+                if index <= self._selection < index + count:
+                    self._selection = None
+                elif self._selection >= index + count:
+                    self._selection -= count
+            if self._active >= index + count:
+                self._active -= count
+            elif self._active >= index:
+                self._active = index
+
+        self._active = max(0, min(self._active, len(self._model) - 1))
+        self._render()
+
+    # the Listbox interface, indices are model indices
+
+    def index(self, index):
+        if index == ACTIVE:
+            return self._active
+        if index == ANCHOR:
+            return self._selection if self._selection is not None else self._active
+        if index == END:
+            return len(self._model)
+        return int(index)
+
+    def size(self):
+        return len(self._model)
+
+    def get(self, first, last=None):
+        first = self.index(first)
+        if last is None:
+            return self._formatter(self._model[first])
+        last = len(self._model) - 1 if last == END else self.index(last)
+        return tuple(self._formatter(self._model[i]) for i in range(first, last + 1))
+
+    def curselection(self):
+        return () if self._selection is None else (self._selection,)
+
+    def selection_clear(self, first=0, last=None):
+        # single selection, any range clears it
+        self._selection = None
+        self._render()
+
+    def selection_set(self, first, last=None):
+        self._selection = self.index(first)
+        self._render()
+
+    def activate(self, index):
+        self._active = self.index(index)
+        self._render()
+
+    def see(self, index):
+        index = min(self.index(index), len(self._model) - 1)
+        if index < self._top:
+            self._top = index
+        elif index >= self._top + self._rows:
+            self._top = index - self._rows + 1
+        self._render()
+
+    def yview(self, *args):
+        n = len(self._model)
+        if not args:
+            return (0.0, 1.0) if n == 0 else (self._top / n, min(n, self._top + self._rows) / n)
+
+        if args[0] == 'moveto':
+            self._top = int(float(args[1]) * n)
+        elif args[0] == 'scroll':
+            step = max(1, self._rows - 1) if args[2] == 'pages' else 1
+            self._top += int(args[1]) * step
+
+        self._render()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2019 Benjamin Milde (Universitaet Hamburg)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# Two-tier (memory + disk) cache for synthesized WAV data, used by tts.TTS.synthesize
+#
+# Both tiers are bounded in bytes and evict the least recently used entries. On disk, the
+# modification time of a file is its last access time.
+#
+
+import os
+import hashlib
+import logging
+import tempfile
+import threading
+
+from collections import OrderedDict
+
+
+def wav_key(engine, voice, locale, mode, txt):
+    return hashlib.sha1(u'\t'.join([engine, voice, locale, mode, txt]).encode('utf8')).hexdigest()
+
+
+class WavCache(object):
+
+    def __init__(self, cache_dir='wav_cache', max_memory_bytes=64 * 1024 * 1024, max_disk_bytes=1024 * 1024 * 1024):
+
+        self._cache_dir = cache_dir
+        self._max_memory_bytes = max_memory_bytes
+        self._max_disk_bytes = max_disk_bytes
+
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+
+        self._lock = threading.Lock()
+
+        self._disk_bytes = 0
+        if self._cache_dir:
+            if not os.path.isdir(self._cache_dir):
+                os.makedirs(self._cache_dir)
+            self._disk_bytes = sum(size for path, mtime, size in self._disk_entries())
+
+    def _disk_path(self, key):
+        return os.path.join(self._cache_dir, key + '.wav')
+
+    def _disk_entries(self):
+        for fn in os.listdir(self._cache_dir):
+            if fn.endswith('.wav'):
+                path = os.path.join(self._cache_dir, fn)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield path, st.st_mtime, st.st_size
+
+    def _put_memory(self, key, wav):
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+
+        if len(wav) > self._max_memory_bytes:
+            return
+
+        self._memory[key] = wav
+        self._memory_bytes += len(wav)
+
+        while self._memory_bytes > self._max_memory_bytes:
+            old_key, old_wav = self._memory.popitem(last=False)
+            self._memory_bytes -= len(old_wav)
+
+    def get(self, engine, voice, locale, mode, txt):
+        key = wav_key(engine, voice, locale, mode, txt)
+
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+        if not self._cache_dir:
+            return None
+
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                wav = f.read()
+            os.utime(path, None)
+        except (IOError, OSError):
+            return None
+
+        with self._lock:
+            self._put_memory(key, wav)
+
+        return wav
+
+    def put(self, engine, voice, locale, mode, txt, wav):
+        if not wav:
+            return
+
+        key = wav_key(engine, voice, locale, mode, txt)
+
+        with self._lock:
+            self._put_memory(key, wav)
+
+        if not self._cache_dir or len(wav) > self._max_disk_bytes:
+            return
+
+        path = self._disk_path(key)
+        if os.path.isfile(path):
+            return
+
+        # write to a temp file first, so that readers never see partially written WAVs
+        fd, tmp_path = tempfile.mkstemp(dir=self._cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(wav)
+        os.rename(tmp_path, path)
+
+        with self._lock:
+            self._disk_bytes += len(wav)
+            if self._disk_bytes > self._max_disk_bytes:
+                self._evict_disk()
+
+    def _evict_disk(self):
+        entries = sorted(self._disk_entries(), key=lambda e: e[1])
+        self._disk_bytes = sum(size for path, mtime, size in entries)
+
+        # evict down to 90% of the limit, so that we don't have to scan the directory on every put
+        for path, mtime, size in entries:
+            if self._disk_bytes <= self._max_disk_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._disk_bytes -= size
+
+        logging.debug('wavcache: %d bytes on disk after eviction' % self._disk_bytes)